@@ -1,4 +1,4 @@
-import logging
+import atexit, logging, Queue, threading
 
 ST_QUEUED, ST_RUNNING, ST_FINISHED, ST_STOPPED, ST_ABORTED, ST_FAILED = 0, 1, 2, 3, 4, 5
 
@@ -21,6 +21,13 @@ def state2str(state):
                ST_ABORTED:"Aborted", ST_FAILED:"Failed"}
     return mapping[state]
 
+def str2state(state_str):
+    """ Converts a describing string, case insensitive, to the numerical job/queue state. """
+    for state in [ST_QUEUED, ST_RUNNING, ST_FINISHED, ST_STOPPED, ST_ABORTED, ST_FAILED]:
+        if state2str(state).lower() == state_str.lower():
+            return state
+    raise ValueError, 'Not a state: %s' % state_str
+
 import os
 
 def norm_path(*parts):
@@ -29,22 +36,286 @@ def norm_path(*parts):
     return os.path.abspath(os.path.expanduser(os.path.join(*parts)))
 
 
-def setup_logging(logfile, level=logging.DEBUG):
-    """ Setup the logging. Should be called at the beginning of every execution (which is flof.py and flofserver.py only at this time). """
-    FORMAT = "%(asctime)s - %(name)s:%(levelname)s - %(message)s"
+LOG_FORMAT = "%(asctime)s - %(name)s:%(levelname)s - %(message)s"
+
+def setup_logging(logfile, level=logging.DEBUG, async_logging=False):
+    """ Setup the logging. Should be called at the beginning of every execution (which is flof.py and flofserver.py only at this time).
+    If async_logging, the records are written to the log file and the console by an AsyncHandler. """
     logfile = norm_path(logfile)
     logdir = os.path.split(logfile)[0]
     if not os.path.isdir(logdir):
         os.makedirs(logdir)                
-    logging.basicConfig(level = int(level), format=FORMAT, filename = logfile)
-    ch  = logging.StreamHandler()
-    ch.setFormatter(logging.Formatter(FORMAT))
-    logging.getLogger().addHandler(ch)
+    handlers = [logging.FileHandler(logfile), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root = logging.getLogger()
+    root.setLevel(int(level))
+    if async_logging:
+        handler = AsyncHandler(handlers)
+        atexit.register(handler.close)
+        handlers = [handler]
+    for handler in handlers:
+        root.addHandler(handler)
+
+
+def flush_logging():
+    """ Flushes the handlers of the root logger, e.g. before aborting. With an AsyncHandler, waits until the queued records are written. """
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+
+
+class AsyncHandler(logging.Handler):
+    """ Passes the records to handlers in a background thread, so the logging threads do not wait for the disk.
+    The thread writes the queued records in batches of up to batch_size, with one write and flush per handler and batch.
+    Records of flush_level and above are written before emit returns, so the last lines before a crash are not lost.
+    In a forked child process, e.g. of a multiprocessing pool, the thread does not exist and the records are written synchronously. """
+
+    timeout = 10 # Seconds to wait for the thread on flush and close
+
+    def __init__(self, handlers, batch_size=256, flush_level=logging.ERROR):
+        logging.Handler.__init__(self)
+        self.handlers = list(handlers)
+        self.batch_size = batch_size
+        self.flush_level = flush_level
+        self._queue = Queue.Queue()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._write, name="AsyncHandler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _threaded(self):
+        """ Returns whether the records are written by the thread, False after close and in a forked child. """
+        if os.getpid() != self._pid:
+            # The thread might have held the locks of the handlers while forking
+            self._pid = os.getpid()
+            self._thread = None
+            for handler in self.handlers:
+                handler.createLock()
+        return self._thread is not None and self._thread.is_alive()
+
+    def emit(self, record):
+        if not self._threaded():
+            self._handle([record])
+            return
+        try:
+            # Merge the arguments now, they might be modified until the record is written
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging._defaultFormatter.formatException(record.exc_info)
+                record.exc_info = None
+            self._queue.put(record)
+        except Exception:
+            self.handleError(record)
+        if record.levelno >= self.flush_level:
+            self.flush()
+
+    def flush(self):
+        """ Waits until the queued records are written. """
+        if self._threaded():
+            written = threading.Event()
+            self._queue.put(written)
+            written.wait(self.timeout)
+
+    def close(self):
+        """ Writes the queued records, stops the thread and closes the handlers. """
+        if self._threaded():
+            self._queue.put(None)
+            self._thread.join(self.timeout)
+            self._thread = None
+        for handler in self.handlers:
+            handler.close()
+        logging.Handler.close(self)
 
+    def _write(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except Queue.Empty:
+                pass
+            self._handle([item for item in batch if isinstance(item, logging.LogRecord)])
+            for item in batch:
+                if item is None:
+                    return
+                elif not isinstance(item, logging.LogRecord):
+                    item.set() # A flush is waiting
 
-from SimpleXMLRPCServer import SimpleXMLRPCServer
-from SocketServer import ThreadingMixIn
+    def _handle(self, records):
+        for handler in self.handlers:
+            selected = [r for r in records if r.levelno >= handler.level and handler.filter(r)]
+            if not selected:
+                continue
+            if isinstance(handler, logging.StreamHandler) and handler.stream is not None:
+                # One write and flush per batch instead of per record
+                handler.acquire()
+                try:
+                    handler.stream.write("".join(handler.format(r) + "\n" for r in selected))
+                    handler.flush()
+                    continue
+                except Exception:
+                    pass # Written record by record below, e.g. for mixed encodings
+                finally:
+                    handler.release()
+            for record in selected:
+                handler.handle(record)
+
+
+_log_handlers = {} # (logger name, filename) -> [handler, reference count]
+_log_handlers_lock = threading.Lock()
+
+def acquire_log_handler(logger, filename):
+    """ Adds a FileHandler for filename to logger, unless the logger already has one. The handlers are reference counted,
+    every call has to be paired with a call of release_log_handler. Returns the handler. """
+    key = (logger.name, filename)
+    with _log_handlers_lock:
+        entry = _log_handlers.get(key)
+        if entry is None:
+            handler = logging.FileHandler(filename)
+            handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            logger.addHandler(handler)
+            entry = _log_handlers[key] = [handler, 0]
+        entry[1] += 1
+        return entry[0]
+
+def release_log_handler(logger, filename):
+    """ Releases a handler acquired by acquire_log_handler. The last release removes it from the logger and closes the file. """
+    key = (logger.name, filename)
+    with _log_handlers_lock:
+        entry = _log_handlers.get(key)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _log_handlers[key]
+            logger.removeHandler(entry[0])
+            entry[0].close()
+
+
+import httplib, socket, tempfile, threading, xmlrpclib
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler, SimpleXMLRPCDispatcher
+from SocketServer import ThreadingMixIn, UnixStreamServer
 
 class ThreadedXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
-    """ Mixin construced from ThreadingMixIn and SimpleXMLRPCServer. """
-    pass
+    """ Mixin construced from ThreadingMixIn and SimpleXMLRPCServer. Handler threads are daemons, so idle keep-alive connections don't keep the process alive. """
+    daemon_threads = True
+
+
+class KeepAliveXMLRPCRequestHandler(SimpleXMLRPCRequestHandler):
+    """ Request handler that keeps the connection open for further requests (HTTP/1.1). """
+    protocol_version = "HTTP/1.1"
+
+
+def runtime_dir():
+    """ Returns the per user directory for the Unix domain sockets, $XDG_RUNTIME_DIR/flof or a flof-uid directory in the temp dir. Creates it if necessary. """
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        path = os.path.join(os.environ["XDG_RUNTIME_DIR"], "flof")
+    else:
+        path = os.path.join(tempfile.gettempdir(), "flof-%i" % os.getuid())
+    if not os.path.isdir(path):
+        os.makedirs(path, 0700)
+    return path
+
+
+def server_socket():
+    """ Path of the Unix domain socket the flofserver listens on if general.unix_sockets is set. """
+    return os.path.join(runtime_dir(), "server.sock")
+
+
+def server_json_socket():
+    """ Path of the Unix domain socket the flofserver offers JSON-RPC on if general.unix_sockets is set. """
+    return os.path.join(runtime_dir(), "server-json.sock")
+
+
+class UnixXMLRPCRequestHandler(KeepAliveXMLRPCRequestHandler):
+    """ Request handler for the ThreadedUnixXMLRPCServer. Unix sockets have neither Nagle's algorithm nor a client address to log. """
+    disable_nagle_algorithm = False
+
+    def address_string(self):
+        return "unix"
+
+
+class ThreadedUnixXMLRPCServer(ThreadingMixIn, UnixStreamServer, SimpleXMLRPCDispatcher):
+    """ XML-RPC server listening on a Unix domain socket, a thread per connection. A stale socket file at path is replaced. """
+    daemon_threads = True
+
+    def __init__(self, path, requestHandler = UnixXMLRPCRequestHandler, logRequests = False, allow_none = False, encoding = None):
+        self.logRequests = logRequests
+        SimpleXMLRPCDispatcher.__init__(self, allow_none, encoding)
+        if os.path.exists(path):
+            os.unlink(path)
+        UnixStreamServer.__init__(self, path, requestHandler)
+
+    def server_close(self):
+        UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    """ HTTP connection to a Unix domain socket. """
+
+    def __init__(self, socket_path, timeout = socket._GLOBAL_DEFAULT_TIMEOUT):
+        httplib.HTTPConnection.__init__(self, "localhost", timeout = timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class UnixTransport(xmlrpclib.Transport):
+    """ xmlrpclib transport to a server on a Unix domain socket, the host part of the URI is ignored. Keeps the connection alive like the default transport. """
+
+    def __init__(self, socket_path, use_datetime = 0):
+        xmlrpclib.Transport.__init__(self, use_datetime)
+        self.socket_path = socket_path
+
+    def make_connection(self, host):
+        if self._connection and host == self._connection[0]:
+            return self._connection[1]
+        self._connection = host, UnixHTTPConnection(self.socket_path)
+        return self._connection[1]
+
+
+class PooledServerProxy:
+    """ A thread safe replacement for xmlrpclib.ServerProxy. Each call borrows a ServerProxy from a pool and returns it afterwards,
+    so the keep-alive connections of the pooled proxies are reused instead of connecting for every call.
+    If socket_path is given, the proxies connect to that Unix domain socket. """
+
+    def __init__(self, uri, socket_path = None, **kwargs):
+        self._uri = uri
+        self._socket_path = socket_path
+        self._kwargs = kwargs
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _call(self, method, *params):
+        with self._lock:
+            proxy = self._idle.pop() if self._idle else None
+        if proxy is None:
+            transport = UnixTransport(self._socket_path) if self._socket_path else None
+            proxy = xmlrpclib.ServerProxy(self._uri, transport, **self._kwargs)
+        try:
+            result = getattr(proxy, method)(*params)
+        except:
+            proxy("close")()
+            raise
+        with self._lock:
+            self._idle.append(proxy)
+        return result
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+        return lambda *params: self._call(method, *params)
+
+    def close(self):
+        """ Closes the connections of all idle proxies. """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for proxy in idle:
+            proxy("close")()
@@ -26,7 +26,17 @@ log = True
 
 [general]
 server_port = 18000
-slave_port = 18001
+json_port = 17999
+slave_port = 0
+max_jobs = 1
+cores = 0
+queue_db = ~/.flof/queue.db
+status_interval = 2
+server_mode = threaded
+unix_sockets = False
+mesh_cache = ~/.flof/cache/mesh
+mesh_cache_size = 10240
+async_logging = False
 """)
 
 
@@ -0,0 +1,175 @@
+import asynchat, asyncore, collections, errno, fcntl, heapq, itertools, logging, os, select, socket, time
+
+logger = logging.getLogger(__name__)
+
+from SimpleXMLRPCServer import SimpleXMLRPCDispatcher
+
+
+class _Waker(asyncore.file_dispatcher):
+    """ Reading end of a pipe in the event loop. Writing to it interrupts the select call. """
+
+    def __init__(self, socket_map):
+        read_fd, self._write_fd = os.pipe()
+        flags = fcntl.fcntl(self._write_fd, fcntl.F_GETFL)
+        fcntl.fcntl(self._write_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        asyncore.file_dispatcher.__init__(self, read_fd, socket_map)
+        os.close(read_fd) # file_dispatcher works on a duplicate
+
+    def wake(self):
+        try:
+            os.write(self._write_fd, "x")
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        try:
+            self.recv(4096)
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+
+# select() is limited to descriptors below FD_SETSIZE (1024), poll() is not
+_poll = asyncore.poll2 if hasattr(select, "poll") else asyncore.poll
+
+
+class EventLoop:
+    """ Single threaded event loop based on asyncore. Besides the dispatchers in map it runs callbacks and timers.
+    call_soon and stop may be called from any thread, everything else only from within the loop.
+    The descriptors are polled with poll(), so there may be more than 1024 of them. """
+
+    def __init__(self):
+        self.map = {}
+        self._callbacks = collections.deque()
+        self._timers = []
+        self._timer_seq = itertools.count()
+        self._running = False
+        self._waker = _Waker(self.map)
+
+    def call_soon(self, callback, *args):
+        """ Runs callback(*args) in the loop as soon as possible. """
+        self._callbacks.append( (callback, args) )
+        self._waker.wake()
+
+    def call_later(self, delay, callback, *args):
+        """ Runs callback(*args) in the loop after delay seconds. """
+        heapq.heappush(self._timers, (time.time() + delay, next(self._timer_seq), callback, args))
+
+    def stop(self):
+        """ Lets run_forever return after the current iteration. """
+        self._running = False
+        self._waker.wake()
+
+    def _run_callback(self, callback, args):
+        try:
+            callback(*args)
+        except Exception:
+            logger.exception("Exception in event loop callback %s.", callback)
+
+    def run_forever(self):
+        """ Runs the loop until stop is called. """
+        self._running = True
+        while self._running:
+            if self._callbacks:
+                timeout = 0
+            elif self._timers:
+                timeout = max(0, self._timers[0][0] - time.time())
+            else:
+                timeout = None
+            try:
+                _poll(timeout, self.map)
+            except Exception:
+                # E.g. a dispatcher failing outside of its handlers, don't let it take down the loop
+                logger.exception("Exception while polling the event loop.")
+                time.sleep(0.1)
+
+            while self._timers and self._timers[0][0] <= time.time():
+                when, seq, callback, args = heapq.heappop(self._timers)
+                self._run_callback(callback, args)
+
+            # Only run the callbacks present now, callbacks scheduled by them run in the next iteration
+            for i in range(len(self._callbacks)):
+                self._run_callback(*self._callbacks.popleft())
+
+
+class _XMLRPCChannel(asynchat.async_chat):
+    """ A connection to the AsyncXMLRPCServer. Reads HTTP POST requests without blocking and pushes the responses. """
+
+    def __init__(self, sock, server):
+        asynchat.async_chat.__init__(self, sock, server.loop.map)
+        self.server = server
+        self._reset()
+
+    def _reset(self):
+        self._buffer = []
+        self._request = None
+        self.set_terminator("\r\n\r\n")
+
+    def collect_incoming_data(self, data):
+        self._buffer.append(data)
+
+    def found_terminator(self):
+        data = "".join(self._buffer)
+        self._buffer = []
+        if self._request is None:
+            lines = data.split("\r\n")
+            headers = {}
+            for line in lines[1:]:
+                key, sep, value = line.partition(":")
+                headers[key.strip().lower()] = value.strip()
+            self._request = (lines[0].split(), headers)
+            length = int(headers.get("content-length", 0))
+            if length > 0:
+                self.set_terminator(length)
+                return
+            data = ""
+        self._respond(data)
+
+    def _respond(self, body):
+        request_line, headers = self._request
+        keep_alive = len(request_line) == 3 and request_line[2] == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        if not request_line or request_line[0] != "POST":
+            status, response = "501 Unsupported method", ""
+        else:
+            status, response = "200 OK", self.server._marshaled_dispatch(body)
+
+        self.push("HTTP/1.1 %s\r\nContent-Type: text/xml\r\nContent-Length: %i\r\n%s\r\n" %
+                  (status, len(response), "" if keep_alive else "Connection: close\r\n"))
+        self.push(response)
+        if keep_alive:
+            self._reset()
+        else:
+            self.close_when_done()
+
+    def handle_error(self):
+        logger.exception("Error on XML-RPC connection, closing it.")
+        self.close()
+
+
+class AsyncXMLRPCServer(asyncore.dispatcher, SimpleXMLRPCDispatcher):
+    """ XML-RPC server that handles all connections within an EventLoop, without a thread per request.
+    Registered functions are called from the loop and must not block. If addr is a path, the server listens on a Unix domain socket. """
+
+    def __init__(self, addr, loop, allow_none=False, encoding=None):
+        asyncore.dispatcher.__init__(self, map=loop.map)
+        SimpleXMLRPCDispatcher.__init__(self, allow_none, encoding)
+        self.loop = loop
+        if isinstance(addr, basestring):
+            if os.path.exists(addr):
+                os.unlink(addr)
+            self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.set_reuse_addr()
+        self.bind(addr)
+        self.listen(socket.SOMAXCONN)
+        self.server_address = self.socket.getsockname()
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            _XMLRPCChannel(pair[0], self)
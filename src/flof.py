@@ -1,6 +1,6 @@
 #!/usr/bin/python2
 
-import logging, optparse, os, sys
+import logging, optparse, os, sys, threading
 
 logger = logging.getLogger(__name__)
   
@@ -16,6 +16,13 @@ def add_options():
     parser.add_option("-o", "--only", help="Execute only the named workers, separated by comma. 'case' worker is implicitly included.")
     parser.add_option("-n", "--not", dest="do_not", help="Do not execute the named workers, separated by comma.")
     parser.add_option("-c", "--context", help="Set a value in the context, format is key=value, comma seperated.")
+    parser.add_option("-i", "--incremental", action="store_true", default=False,
+                      help="Skip workers whose configuration, context and input files have not changed since their last successful run.")
+    parser.add_option("--no-run", action="store_true", default=False,
+                      help="Do not run the workers immediately. Start a XML-RPC slave and wait for the flofserver to call run.")
+    parser.add_option("-p", "--port", type="int", help="Port the XML-RPC slave listens on. Defaults to general.slave_port, 0 chooses a free port.")
+    parser.add_option("--socket", help="Path of a Unix domain socket the XML-RPC slave listens on instead of a port.")
+    parser.add_option("--ready-fd", type="int", help="File descriptor the XML-RPC slave writes its port or socket path to as soon as it is listening.")
     return parser
 
 
@@ -33,6 +40,76 @@ def parse_context(arg):
     return context
 
 
+class FlofSlave():
+    """ XML-RPC interface of a flof.py process that was started by the flofserver using --no-run.
+    The workers are executed when run is called, the process exits after they have finished. """
+
+    exit_code = 0
+
+    def __init__(self, config, context):
+        self.config = config
+        self.context = context
+        self._thread = threading.Thread(target=self._run)
+
+    def serve(self, address, ready_fd = None):
+        """ Listens for requests until the workers have finished. address is a port or the path of a Unix domain socket.
+        If ready_fd is given, the port or path is written to it once the slave is listening. """
+        if isinstance(address, basestring):
+            self._server = common.ThreadedUnixXMLRPCServer(address, allow_none = True)
+        else:
+            self._server = common.ThreadedXMLRPCServer( ("localhost", address), requestHandler = common.KeepAliveXMLRPCRequestHandler,
+                                                        allow_none = True, logRequests=False )
+            address = self._server.server_address[1]
+        for func in [self.run, self.abort, self.active_worker, self.worker_info]:
+            self._server.register_function(func)
+        logger.info("flof slave listening on %s.", address)
+        if ready_fd is not None:
+            os.write(ready_fd, "%s\n" % address)
+            os.close(ready_fd)
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def _run(self):
+        try:
+            RootWorker(self.config, self.context).run()
+        except Exception:
+            logger.exception("Worker execution failed.")
+            self.exit_code = 1
+
+        if WorkerFactory.aborted():
+            self.exit_code = common.ST_ABORTED
+        self._server.shutdown()
+
+    def run(self):
+        """ Starts the execution of the workers and returns immediately. """
+        if self._thread.ident is not None:
+            return False
+        self._thread.start()
+        return True
+
+    def abort(self):
+        """ Aborts the running worker and all further workers. """
+        WorkerFactory.abort()
+        common.flush_logging()
+        return True
+
+    def active_worker(self):
+        """ Returns the name of the worker currently running, if no worker is running, returns "" """
+        if WorkerFactory.running:
+            return WorkerFactory.running[-1].name
+        else:
+            return ""
+
+    def worker_info(self):
+        """ Returns a dictionary of worker specific info, e.g. timestep. """
+        if WorkerFactory.running:
+            return WorkerFactory.running[-1].info()
+        else:
+            return {}
+
+
 def main():
     oparser = add_options()
     (options, args) = oparser.parse_args()
@@ -47,7 +124,7 @@ def main():
     config_file = norm_path(args[0])
     config = configuration.parse_merge(config_file)
     loglevel = config.getroot().get("loglevel", 10)
-    common.setup_logging("~/.flof/flof.log", loglevel)
+    common.setup_logging("~/.flof/flof.log", loglevel, configuration.Configuration().getboolean("general", "async_logging"))
  
     register_bundled_workers()
 
@@ -57,10 +134,21 @@ def main():
     if options.do_not:
         WorkerRegistry.workers = filter(lambda a: a not in options.do_not.split(","), WorkerRegistry.workers)
 
+    WorkerFactory.incremental = options.incremental
+
     os.chdir(os.path.dirname(norm_path(args[0])))
     context = ContextManager({"config_file" : config_file})
     context.overrides = parse_context(options.context)
-    RootWorker(config, context).run()
+
+    if options.no_run:
+        address = options.socket or options.port
+        if address is None:
+            address = configuration.Configuration().getint("general", "slave_port")
+        slave = FlofSlave(config, context)
+        slave.serve(address, options.ready_fd)
+        sys.exit(slave.exit_code)
+    else:
+        RootWorker(config, context).run()
     
 
 if __name__ == "__main__":
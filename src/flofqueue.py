@@ -1,27 +1,66 @@
 #!/usr/bin/python2
 
-import xmlrpclib, sys
-from common import norm_path, state2str, ST_RUNNING
+import optparse, socket, xmlrpclib, sys
+import common, jsonrpc
+from common import norm_path, state2str, str2state, ST_RUNNING
 from configuration import Configuration
 
+
+def connect(config):
+    """ Returns a proxy to the flofserver. Uses the JSON-RPC transport if the server offers it, XML-RPC otherwise.
+    With general.unix_sockets, both go through the Unix domain sockets of the server. """
+    unix_sockets = config.getboolean("general", "unix_sockets")
+    json_port = config.getint("general", "json_port")
+    if json_port:
+        try:
+            if unix_sockets:
+                return jsonrpc.ServerProxy(socket_path = common.server_json_socket())
+            return jsonrpc.ServerProxy("localhost", json_port)
+        except socket.error:
+            pass
+    if unix_sockets:
+        return xmlrpclib.ServerProxy("http://localhost/", common.UnixTransport(common.server_socket()), allow_none = True)
+    port = config.getint("general", "server_port")
+    return xmlrpclib.ServerProxy("http://localhost:%i/" % port, allow_none = True)
+
 config = Configuration()
-port = config.getint("general", "server_port")
+proxy = connect(config)
+
 
-proxy = xmlrpclib.ServerProxy("http://localhost:%i/" % port, allow_none = True)
+def list_options():
+    """ Factory function for the OptionParser of the list action. """
+    parser = optparse.OptionParser(usage="%prog list [options]")
+    parser.add_option("--offset", type="int", default=0, help="Skip the first OFFSET jobs.")
+    parser.add_option("--limit", type="int", help="List at most LIMIT jobs.")
+    parser.add_option("--state", help="List only jobs in the given state, e.g. queued or running.")
+    parser.add_option("--min-prio", type="int", help="List only jobs with at least the given priority.")
+    parser.add_option("--count", action="store_true", default=False, help="Print only the number of matching jobs.")
+    return parser
 
 
-def list_queue():
+def list_queue(args = []):
     """ Gives a list of enquened jobs and their status. """
-    queue = proxy.get_queue()
+    oparser = list_options()
+    (options, args) = oparser.parse_args(args)
+    try:
+        state = str2state(options.state) if options.state else None
+    except ValueError as e:
+        oparser.error(str(e))
+
+    size = proxy.queue_size(state, options.min_prio)
+    if options.count:
+        print size
+        return
+    queue = proxy.get_queue(options.offset, options.limit, state, options.min_prio)
 
     print "Queue State: ", state2str(proxy.queue_state())
-    print "Queue Size:  ", len(queue)
+    print "Queue Size:  ", size
     print ""
     
-    fmt_str = "{jid!s:8}{config:60}{prio!s:10}{state:5}"
+    fmt_str = "{jid!s:8}{config:60}{prio!s:10}{cores!s:7}{state:5}"
     run_fmt_str = "        Active Worker: {active_worker:44} Worker Information: {worker_info}"
-    print fmt_str.format(jid="Job ID", config="Configuration File", prio="Priority", state="State")
-    print "---------------------------------------------------------------------------------------"
+    print fmt_str.format(jid="Job ID", config="Configuration File", prio="Priority", cores="Cores", state="State")
+    print "----------------------------------------------------------------------------------------------"
     for i in queue:
         state = i["state"]
         i["state"] = state2str(i["state"])
@@ -42,16 +81,20 @@ def stop():
     print "Stopping queue."
     proxy.stop_queue()
 
-def abort():
-    """ Aborts the job. Assumes that there is only one job running at a time. """
-    queue = proxy.get_queue()
-    for i in queue:
-        if i["state"] == ST_RUNNING:
-            proxy.abort(i["jid"])
-            print "Job %s aborted" % i["jid"]
-            return
+def abort(jid = None):
+    """ Aborts the given job. If no job is given, all running jobs are aborted. """
+    if jid is not None:
+        proxy.abort(jid)
+        print "Job %s aborted" % jid
+        return
+
+    running = [i for i in proxy.get_queue() if i["state"] == ST_RUNNING]
+    for i in running:
+        proxy.abort(i["jid"])
+        print "Job %s aborted" % i["jid"]
 
-    print "Can't abort, not running jobs."
+    if not running:
+        print "Can't abort, not running jobs."
 
 def put(case_config, prio):
     case_config = norm_path(case_config)
@@ -59,6 +102,64 @@ def put(case_config, prio):
     jid = proxy.enqueue(prio, case_config)
     print "Queued job with ID", jid
 
+
+def put_many_options():
+    """ Factory function for the OptionParser of the put-many action. """
+    parser = optparse.OptionParser(usage="%prog put-many [options] [case config file ...]")
+    parser.add_option("-p", "--prio", type="int", default=10, help="Priority of the jobs, default is 10.")
+    return parser
+
+
+def put_many(args = []):
+    """ Puts many jobs in the queue with a single call. The case config files are given as arguments or,
+    if there are none, read from stdin, one per line, optionally followed by a priority. """
+    oparser = put_many_options()
+    (options, files) = oparser.parse_args(args)
+    if files:
+        jobs = [(options.prio, norm_path(f)) for f in files]
+    else:
+        jobs = []
+        for number, line in enumerate(sys.stdin, 1):
+            parts = line.split()
+            if parts:
+                try:
+                    prio = int(parts[1]) if len(parts) > 1 else options.prio
+                except ValueError:
+                    oparser.error("Invalid priority in line %i of stdin: %s" % (number, line.strip()))
+                jobs.append((prio, norm_path(parts[0])))
+
+    jids = proxy.enqueue_many(jobs)
+    print "Queued %i jobs with IDs %s to %s." % (len(jids), jids[0], jids[-1]) if jids else "No jobs queued."
+
+
+
+def put_array_options():
+    """ Factory function for the OptionParser of the put-array action. """
+    parser = optparse.OptionParser(usage="%prog put-array [options] <case config file> <variable> <range>")
+    parser.add_option("-p", "--prio", type="int", default=10, help="Priority of the jobs, default is 10.")
+    return parser
+
+
+def put_array(args = []):
+    """ Puts a job array in the queue, one job per value of the range. The range is a Python expression,
+    like the range attribute of a variation, e.g. 'range(10)' or '[0.1, 0.2, 0.5]'. """
+    oparser = put_array_options()
+    (options, args) = oparser.parse_args(args)
+    if len(args) != 3:
+        oparser.error("Expecting a case config file, a variable and a range.")
+    case_config, variable, var_range = args
+    jids = proxy.enqueue_array(options.prio, norm_path(case_config), variable, list(eval(var_range)))
+    print "Queued job array %s with %i jobs." % (jids[0], len(jids)) if jids else "No jobs queued."
+
+
+def array_status(array_id):
+    """ Prints the number of jobs of the job array per state. """
+    status = proxy.array_status(array_id)
+    if not status:
+        print "No job array with ID", array_id
+    for state, count in sorted(status.items()):
+        print "{0:10}{1:>8}".format(state, count)
+
     
 def delete(jid):
     """ Deletes the given job. """
@@ -74,11 +175,15 @@ def repriorize(jid, new_prio):
 def help():
     print "Usage:", sys.argv[0], "action <arguments>\n"
     print "action can be:\n"
-    print "list                            List queued jobs."
+    print "list [options]                  List queued jobs. See list --help for paging and filtering."
     print "start                           Start the queue."
     print "stop                            Stops the queue. Currently running jobs are not affected."
-    print "abort                           Aborts the currently running job."
+    print "abort [jid]                     Aborts the given job or all currently running jobs."
     print "put <case config file> [prio]   Puts the specified case control file with a priority in the queue. prio is optional, default is 10."
+    print "put-many [options] [files]      Puts many case control files in the queue at once, reads them from stdin if none are given. See put-many --help."
+    print "put-array [options] <case config file> <variable> <range>"
+    print "                                Puts a job array in the queue, one job per value of the range. See put-array --help."
+    print "array <array id>                Shows the number of jobs of the job array per state."
     print "del <jid>                       Removes a job from the queue given by the job id."
     print "reprio <jid> <prio>             Repriorize a job."
     
@@ -87,16 +192,22 @@ def main():
         action = sys.argv[1]
 
         if action == "list":
-            list_queue()
+            list_queue(sys.argv[2:])
         elif action == "start":
             start()
         elif action == "stop":
             stop()
         elif action == "abort":
-            abort()
+            abort(*sys.argv[2:3])
         elif action == "put":
             sys.argv.append("10") # Just put the default value, if it is given, it's ignored by the next line.
             put(*sys.argv[2:4])
+        elif action == "put-many":
+            put_many(sys.argv[2:])
+        elif action == "put-array":
+            put_array(sys.argv[2:])
+        elif action == "array":
+            array_status(sys.argv[2])
         elif action == "del":
             delete(sys.argv[2])
         elif action == "reprio":
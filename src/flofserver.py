@@ -1,30 +1,97 @@
 #!/usr/bin/python2
 
-import logging, optparse
+import atexit, logging, optparse, threading
 
 logger = logging.getLogger(__name__)
 
-import common, jobqueue
+import common, eventloop, jobqueue, jobstore, jsonrpc
 from configuration import Configuration
 
 
 class FlofServer():
-    """ FlofServer works as a XMLRPC-Server. It is controlled by flofqueue.py and manages the queue.  """
-    jobqueue = jobqueue.JobQueue()
+    """ FlofServer works as a XMLRPC-Server. It is controlled by flofqueue.py and manages the queue.
+    With general.server_mode = eventloop, requests and the job scheduling are handled by a single event loop instead of a thread per request.
+    The same methods are offered through the JSON-RPC transport on general.json_port, unless it is 0.
+    With general.unix_sockets, the XML-RPC server, the JSON-RPC server and the job slaves listen on Unix domain sockets in common.runtime_dir()
+    instead of TCP ports, no TCP port is opened at all. """
 
     def __init__(self, config):
-        port = config.getint("general", "server_port")
-        server = common.ThreadedXMLRPCServer( ('', port), allow_none = True, logRequests=False )
+        loop = None
+        if config.get("general", "server_mode") == "eventloop":
+            loop = eventloop.EventLoop()
+
+        socket_dir = None
+        if config.getboolean("general", "unix_sockets"):
+            socket_dir = common.runtime_dir()
+
+        store = None
+        if config.get("general", "queue_db"):
+            store = jobstore.JobStore(config.get("general", "queue_db"))
+            atexit.register(store.close)
+
+        self.jobqueue = jobqueue.JobQueue(config.getint("general", "max_jobs"),
+                                          config.getint("general", "slave_port"),
+                                          config.getint("general", "cores"),
+                                          store,
+                                          config.getfloat("general", "status_interval"),
+                                          loop,
+                                          socket_dir)
+        if store:
+            self.jobqueue.restore()
+        if socket_dir:
+            address = common.server_socket()
+        else:
+            address = ('', config.getint("general", "server_port"))
+        if loop:
+            server = eventloop.AsyncXMLRPCServer( address, loop, allow_none = True )
+        elif socket_dir:
+            server = common.ThreadedUnixXMLRPCServer( address, allow_none = True )
+        else:
+            server = common.ThreadedXMLRPCServer( address, allow_none = True, logRequests=False )
         server.register_introspection_functions()
         server.register_instance(self)
-        logger.info("flofserver listening on port %i.", port)
-        server.serve_forever()       
+        logger.info("flofserver listening on %s.", address)
+
+        json_port = config.getint("general", "json_port")
+        if json_port:
+            json_address = common.server_json_socket() if socket_dir else ('', json_port)
+            if loop:
+                json_server = jsonrpc.AsyncJSONRPCServer( json_address, loop )
+            else:
+                if socket_dir:
+                    json_server = jsonrpc.ThreadedUnixJSONRPCServer( json_address )
+                else:
+                    json_server = jsonrpc.ThreadedJSONRPCServer( json_address )
+                json_thread = threading.Thread(target=json_server.serve_forever)
+                json_thread.daemon = True
+                json_thread.start()
+            json_server.register_introspection_functions()
+            json_server.register_instance(self)
+            logger.info("flofserver listening for JSON-RPC on %s.", json_address)
+
+        if loop:
+            loop.run_forever()
+        else:
+            server.serve_forever()       
                     
     def enqueue(self, prio, case_config):
         """ Enqueue a new job with given priority. case_config is a string to the configuration file. """
         ret = self.jobqueue.put( jobqueue.Job(prio, case_config) )
         return ret
 
+    def enqueue_many(self, jobs):
+        """ Enqueue many jobs at once. jobs is a list of (prio, case_config) pairs. Returns the list of job IDs. """
+        return self.jobqueue.put_many( [jobqueue.Job(prio, case_config) for prio, case_config in jobs] )
+
+    def enqueue_array(self, prio, case_config, variable, values):
+        """ Enqueue a job array, one job per value in values with the context variable set to that value.
+        Returns the list of job IDs, the first one is the ID of the array. """
+        return self.jobqueue.put_many( jobqueue.job_array(prio, case_config, variable, values) )
+
+    def array_status(self, array_id):
+        """ Returns the number of jobs of a job array per state, e.g. {"Queued" : 10, "Running" : 2}. """
+        return self.jobqueue.array_status(array_id)
+
     def start_queue(self):
         """ Starts the queue. Initial state of queue is stopped. """
         return self.jobqueue.start()
@@ -41,13 +108,20 @@ class FlofServer():
         """ Delete a specific job, given by the job ID from the queue. """
         return self.jobqueue.delete(jid)
     
-    def get_queue(self):
-        """ Returns the entire queue as a list of jobs. Each job is represented by a dictionary. """
-        return self.jobqueue.as_dict()
+    def get_queue(self, offset = 0, limit = None, state = None, min_prio = None):
+        """ Returns the queue as a list of jobs. Each job is represented by a dictionary.
+        Only jobs with the given state and at least priority min_prio are returned, at most limit jobs starting at offset.
+        The information on the active worker of running jobs is at most general.status_interval seconds old. """
+        return self.jobqueue.as_dict(offset, limit, state, min_prio)
+
+    def queue_size(self, state = None, min_prio = None):
+        """ Returns the number of jobs with the given state and at least priority min_prio. """
+        return self.jobqueue.count(state, min_prio)
 
     def abort(self, jid):
         """ Aborts a job. Do nothing, if the job is not running. """
         self.jobqueue.abort(jid)
+        common.flush_logging()
         return 0
 
     def reprio(self, jid, new_prio):
@@ -62,8 +136,8 @@ def add_options():
 
     
 if __name__ == "__main__":
-    common.setup_logging("~/.flof/flofserver.log")
     oparser = add_options()
     (options, args) = oparser.parse_args()
     configuration = Configuration(cmd_config = options.config)
+    common.setup_logging("~/.flof/flofserver.log", async_logging = configuration.getboolean("general", "async_logging"))
     FlofServer(configuration)
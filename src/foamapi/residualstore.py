@@ -0,0 +1,121 @@
+""" Columnar storage of the solver progress, written next to the log file of a solver. The store is a directory holding a file per
+column: time, courant, execution_time and the initial residual of each field. Each file is an append-only array of little endian
+float64 values, one per time step. Values missing in a time step are NaN. Reading memory maps the files, so getting the
+last residuals of a long run does not read the whole history. """
+
+import array, mmap, os, struct, sys, time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NAN = float("nan")
+
+
+class ResidualWriter:
+    """ Appends SolverProgress.Step records to the store at path. The rows are buffered and written every flush_steps steps,
+    at least every flush_interval seconds and on close. An existing store is continued. """
+
+    def __init__(self, path, flush_steps = 256, flush_interval = 5):
+        self.path = path
+        self.flush_steps = flush_steps
+        self.flush_interval = flush_interval
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.rows = 0
+        self._columns = {}
+        for f in os.listdir(path):
+            if f.endswith(".f8"):
+                self.rows = max(self.rows, os.path.getsize(os.path.join(path, f)) // 8)
+                self._columns[f[:-3]] = array.array("d")
+        self._buffered = 0
+        self._last_flush = time.time()
+
+    def _column(self, name):
+        if name not in self._columns:
+            # A field first solved in this step, the buffered steps have no value. The written ones are padded on flush.
+            self._columns[name] = array.array("d", [NAN] * self._buffered)
+        return self._columns[name]
+
+    def append(self, step):
+        """ Appends a time step. """
+        values = dict(("residual_" + field, value) for field, value in step.residuals.iteritems())
+        values.update(time = step.time, courant = step.courant, execution_time = step.execution_time)
+        for name in values:
+            self._column(name)
+        for name, column in self._columns.iteritems():
+            value = values.get(name)
+            column.append(NAN if value is None else value)
+        self._buffered += 1
+        if self._buffered >= self.flush_steps or time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """ Writes the buffered rows. """
+        for name, column in self._columns.iteritems():
+            if sys.byteorder != "little":
+                column.byteswap()
+            filename = os.path.join(self.path, name + ".f8")
+            # A column created since the last flush gets padded for the rows already written
+            missing = self.rows - (os.path.getsize(filename) // 8 if os.path.exists(filename) else 0)
+            with open(filename, "ab") as f:
+                if missing > 0:
+                    array.array("d", [NAN] * missing).tofile(f)
+                column.tofile(f)
+            del column[:]
+        self.rows += self._buffered
+        self._buffered = 0
+        self._last_flush = time.time()
+
+    def close(self):
+        self.flush()
+
+
+class Column:
+    """ A column of the store, memory mapped. Supports len and indexing, also by slices, which return lists. """
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._len = os.fstat(self._file.fileno()).st_size // 8
+        self._map = mmap.mmap(self._file.fileno(), self._len * 8, access = mmap.ACCESS_READ) if self._len else ""
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, stride = index.indices(self._len)
+            if stride != 1:
+                return [self[i] for i in range(start, stop, stride)]
+            values = array.array("d", self._map[start * 8 : max(start, stop) * 8])
+            if sys.byteorder != "little":
+                values.byteswap()
+            return values.tolist()
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("column index out of range")
+        return struct.unpack_from("<d", self._map, index * 8)[0]
+
+    def close(self):
+        if self._len:
+            self._map.close()
+        self._file.close()
+
+
+def open_store(path):
+    """ Opens the store at path for reading. Returns a dictionary of the columns by name, e.g. time or residual_p.
+    The columns are numpy.memmap arrays if numpy is available, Column objects otherwise. """
+    columns = {}
+    for f in os.listdir(path):
+        if f.endswith(".f8"):
+            filename = os.path.join(path, f)
+            if numpy is not None:
+                if os.path.getsize(filename):
+                    columns[f[:-3]] = numpy.memmap(filename, dtype = "<f8", mode = "r")
+                else:
+                    columns[f[:-3]] = numpy.zeros(0)
+            else:
+                columns[f[:-3]] = Column(filename)
+    return columns
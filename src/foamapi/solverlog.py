@@ -0,0 +1,74 @@
+""" Incremental parsing of the output of OpenFOAM solvers. """
+
+import collections
+
+
+class SolverProgress:
+    """ Extracts the progress of a solver from its output, line by line: the simulation time, the initial residual of each solved field,
+    the maximum Courant number and the execution time. The last size time steps are kept in a ring buffer.
+    Only lines starting with the few known prefixes or containing "Solving for" are looked at closer.
+    If given, on_step is called with each completed Step, e.g. to store the history. """
+
+    Step = collections.namedtuple("Step", "time courant execution_time residuals")
+
+    def __init__(self, size = 100, on_step = None):
+        self.steps = collections.deque(maxlen = size)
+        self.on_step = on_step
+        self.count = 0
+        self._time = None
+        self._courant = None
+        self._execution_time = None
+        self._residuals = {}
+
+    def feed(self, line):
+        """ Parses the next line of output. """
+        if line.startswith("Time = "):
+            self._finish_step()
+            self._time = _float(line[7:])
+        elif line.startswith("Courant Number mean: "):
+            self._courant = _float(line[line.rfind(" ") + 1:])
+        elif line.startswith("ExecutionTime = "):
+            self._execution_time = _float(line[16:line.find(" s", 16)])
+        elif line == "End":
+            self._finish_step()
+            self._time = None
+        elif "Solving for " in line:
+            start = line.find("Solving for ") + 12
+            field = line[start:line.find(",", start)]
+            if field not in self._residuals: # Only the first solution of a step, e.g. the first PISO corrector
+                start = line.find("Initial residual = ", start) + 19
+                self._residuals[field] = _float(line[start:line.find(",", start)])
+
+    def _finish_step(self):
+        if self._time is not None:
+            step = self.Step(self._time, self._courant, self._execution_time, self._residuals)
+            self.steps.append(step)
+            self.count += 1
+            if self.on_step:
+                self.on_step(step)
+        self._courant = None
+        self._execution_time = None
+        self._residuals = {}
+
+    def info(self):
+        """ Returns a dictionary describing the last completed time step, empty if there is none. step_time is the average
+        execution time per time step over the ring buffer. """
+        if not self.steps:
+            return {}
+        last = self.steps[-1]
+        info = {"time" : last.time, "steps" : self.count, "residuals" : last.residuals}
+        if last.courant is not None:
+            info["courant"] = last.courant
+        if last.execution_time is not None:
+            info["execution_time"] = last.execution_time
+            first = self.steps[0]
+            if len(self.steps) > 1 and first.execution_time is not None:
+                info["step_time"] = (last.execution_time - first.execution_time) / (len(self.steps) - 1)
+        return info
+
+
+def _float(s):
+    try:
+        return float(s)
+    except ValueError:
+        return None
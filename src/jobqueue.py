@@ -1,60 +1,211 @@
-import itertools, logging, subprocess, threading, time, xmlrpclib
+import errno, fcntl, heapq, itertools, logging, multiprocessing, os, select, signal, subprocess, threading, time
+import xml.etree.ElementTree as ET
 
 logger = logging.getLogger(__name__)
 
 from configuration import Configuration
 
 import common
-from common import ST_QUEUED, ST_RUNNING, ST_FINISHED, ST_STOPPED, ST_ABORTED, ST_FAILED
+from common import norm_path, ST_QUEUED, ST_RUNNING, ST_FINISHED, ST_STOPPED, ST_ABORTED, ST_FAILED
 
 
 generate_jid = itertools.count(1).next
 
+
+def requested_cores(case_config):
+    """ Returns the number of cores a job needs, that is the largest number of domains of all <decompose> workers in its configuration. """
+    try:
+        root = ET.parse(case_config).getroot()
+    except (IOError, ET.ParseError):
+        return 1
+
+    cores = 1
+    for node in root.iter("decompose"):
+        try:
+            if common.getboolean(node.get("do", "True")):
+                cores = max(cores, int(node.get("n", 1)))
+        except ValueError:
+            pass # Values subject to string interpolation can't be evaluated here
+    return cores
+
+
+def process_alive(pid):
+    """ Returns True if a flof.py process with the given pid exists. """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno != errno.EPERM:
+            return False
+    try:
+        with open("/proc/%i/cmdline" % pid) as f:
+            return "flof.py" in f.read()
+    except IOError:
+        return True # No procfs, can't guard against reused pids
+
+
 class Job:
-    """ Represents a job. Starts flof.py and connects to it. """
+    """ Represents a job. Starts flof.py and connects to it.
+    Only the path to the configuration file is stored when the job is created. The number of requested cores and
+    the full configuration are parsed when they are first needed, which is usually when the job is about to be started. """
     _connection = None
+    _config = None
+    _cores = None
     _child_proc = None
+    _state = ST_QUEUED
+    _status = {"active_worker" : "", "worker_info" : {}}
+    pid = None
+    slave_port = None # Port the slave listens on, or the path of its Unix domain socket.
+    context = {} # Context overrides, passed to flof.py by --context.
+    array_id = None # Job ID of the first job of the job array this job belongs to.
+    ready_timeout = 60 # Seconds to wait for the slave to report its port.
+    on_ready = None # Called with the job as argument when the slave has reported its port.
+    on_exit = None # Called with the job as argument when the child process has exited.
     
-    def __init__(self, prio, config):
+    def __init__(self, prio, config, jid = None):
         self.prio = int(prio)
-        self.config = Configuration(config)
-        self.jid = generate_jid()
+        self.case_config = norm_path(config)
+        self.jid = generate_jid() if jid is None else int(jid)
 
-    def run(self):
-        """ Runs the job asynchronously by calling 'flof.py --no-run config_file'. """
+    @property
+    def config(self):
+        """ The full configuration of the job. """
+        if self._config is None:
+            self._config = Configuration(self.case_config)
+        return self._config
+
+    @property
+    def cores(self):
+        """ Number of cores the job requests. """
+        if self._cores is None:
+            self._cores = requested_cores(self.case_config)
+        return self._cores
+
+    def run(self, address):
+        """ Runs the job asynchronously by calling 'flof.py --no-run --port port --ready-fd fd config_file'.
+        If address is a path, the slave listens on that Unix domain socket instead, using --socket.
+        The slave writes its address to the pipe fd, port 0 lets it choose a free port. """
         assert self.state == ST_QUEUED
 
-        self._child_proc = subprocess.Popen(["flof.py", "--no-run", self.config.case_config])
-        time.sleep(2) # Wait some seconds to allow server to start
-        logger.info("Job %s started: %s", str(self.jid), self.config.case_config)
+        ready_read, ready_write = os.pipe()
+        fcntl.fcntl(ready_read, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        try:
+            self._child_proc = subprocess.Popen(self.command(address, ready_write))
+        except:
+            os.close(ready_read)
+            raise
+        finally:
+            os.close(ready_write)
+        self.pid = self._child_proc.pid
+        self._state = ST_RUNNING
+        waiter = threading.Thread(target=self._wait, args=(ready_read,))
+        waiter.daemon = True
+        waiter.start()
+
+
+    def command(self, address, ready_fd):
+        """ Returns the command line of the slave. """
+        if isinstance(address, basestring):
+            cmd = ["flof.py", "--no-run", "--socket", address]
+        else:
+            cmd = ["flof.py", "--no-run", "--port", str(address)]
+        if self.context:
+            cmd += ["--context", ",".join("%s=%s" % i for i in sorted(self.context.items()))]
+        return cmd + ["--ready-fd", str(ready_fd), self.case_config]
+
+    def _read_address(self, ready_fd):
+        """ Reads the port or socket path from the ready pipe. Returns None if the slave exits or times out before reporting it. """
+        data = ""
+        deadline = time.time() + self.ready_timeout
+        while not data.endswith("\n"):
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([ready_fd], [], [], remaining)[0]:
+                logger.warning("Slave of job %s did not get ready within %i seconds.", self.jid, self.ready_timeout)
+                self.abort(force=True)
+                return None
+            chunk = os.read(ready_fd, 256)
+            if not chunk:
+                logger.warning("Slave of job %s exited before it was ready.", self.jid)
+                return None
+            data += chunk
+        data = data.strip()
+        return int(data) if data.isdigit() else data
+
+    def _open_connection(self, address):
+        """ Creates the proxy to a slave listening on a TCP port or, if address is a path, on a Unix domain socket. """
+        self.slave_port = address
+        if isinstance(address, basestring):
+            self._connection = common.PooledServerProxy("http://localhost/", socket_path = address, allow_none = True)
+        else:
+            self._connection = common.PooledServerProxy("http://localhost:%i/" % address, allow_none = True)
+
+    def _connect(self, ready_fd):
+        """ Connects to the slave as soon as it is ready and starts the run. """
+        try:
+            address = self._read_address(ready_fd)
+        finally:
+            os.close(ready_fd)
+        if address is None:
+            return
 
-        self._connection = xmlrpclib.ServerProxy("http://localhost:%i/" %
-                                                 self.config.getint("general", "slave_port"),
-                                                 allow_none = True)
+        logger.info("Job %s started on %s: %s", str(self.jid), address, self.case_config)
+        self._open_connection(address)
+        if self.on_ready:
+            self.on_ready(self)
         try:
             self._connection.run() 
         except:
             logger.warning("Exception raised while running the flof client. This may happen if a run is aborted.")
-        
+
+    def _wait(self, ready_fd):
+        """ Connects to the slave, waits for the child process to exit, updates the state and calls on_exit. """
+        self._connect(ready_fd)
+        returncode = self._child_proc.wait()
+        if returncode == ST_ABORTED:
+            self._state = ST_ABORTED
+        elif returncode == 0:
+            self._state = ST_FINISHED
+        else:
+            self._state = ST_FAILED
+        logger.info("Job %s exited with return code %i.", self.jid, returncode)
+        self._disconnect()
+        if self.on_exit:
+            self.on_exit(self)
+
+    def _disconnect(self):
+        if self._connection:
+            self._connection.close()
+
+    def attach(self, pid, address):
+        """ Re-attaches to the slave of a job that was started by a previous flofserver process.
+        The slave is not a child of this process, so its return code is not available. """
+        self.pid = pid
+        self._state = ST_RUNNING
+        if address:
+            self._open_connection(address)
+        waiter = threading.Thread(target=self._wait_attached)
+        waiter.daemon = True
+        waiter.start()
+
+    def _wait_attached(self):
+        """ Polls a re-attached slave until it has exited. """
+        while process_alive(self.pid):
+            time.sleep(1)
+        self._state = ST_FINISHED
+        logger.info("Re-attached job %s has exited, its return code is unknown.", self.jid)
+        self._disconnect()
+        if self.on_exit:
+            self.on_exit(self)
 
     @property
     def state(self):
-        if self._child_proc == None:
-            return ST_QUEUED
-        elif self._child_proc.poll() == None:
-            return ST_RUNNING
-        elif self._child_proc.returncode == ST_ABORTED:
-            return ST_ABORTED
-        elif self._child_proc.returncode == 0:
-            return ST_FINISHED
-        elif self._child_proc.returncode != 0:
-            return ST_FAILED
+        """ State of the job. It is set when the job is started and when its process exits, not polled. """
+        return self._state
         
     def abort(self, force=False):
         """ Aborts the job. If force is True the process is simply killed. Otherwise a XML-RPC call to abort is send. """
         if force:
-            if self._child_proc and not self._child_proc.poll():
-                self._child_proc.kill()
+            if self._state == ST_RUNNING:
+                os.kill(self.pid, signal.SIGKILL)
         else:
             try:
                 self._connection.abort()
@@ -74,117 +225,437 @@ class Job:
             return self._connection.worker_info()
         except:
             return {}
-        
+
+    def refresh_status(self):
+        """ Fetches the active worker and its information from the slave and caches them for as_dict. """
+        self._status = {"active_worker" : self.active_worker(), "worker_info" : self.worker_info()}
        
     def as_dict(self):
-        """ Dictionary with job specific information. """
+        """ Dictionary with job specific information. Information on the active worker is taken from the status cache, no call to the slave is made. """
+        status = self._status if self.state == ST_RUNNING else Job._status
         return {
             "jid": self.jid,
             "prio": self.prio,
-            "config": self.config.case_config,
+            "cores": self.cores,
+            "config": self.case_config,
             "state": self.state,
-            "active_worker" : self.active_worker(),
-            "worker_info" : self.worker_info()
+            "array_id": self.array_id,
+            "context": self.context,
+            "active_worker" : status["active_worker"],
+            "worker_info" : status["worker_info"]
             }
 
+
+class ArrayJob(Job):
+    """ A job of a job array. All jobs of an array run the same configuration and differ only by their context overrides.
+    The configuration is parsed once by the template job, which is shared by the jobs of the array and never run itself. """
+
+    def __init__(self, prio, template, array_id, context, jid = None):
+        Job.__init__(self, prio, template.case_config, jid)
+        self.template = template
+        self.array_id = int(array_id)
+        self.context = context
+
+    @property
+    def config(self):
+        return self.template.config
+
+    @property
+    def cores(self):
+        return self.template.cores
+
+
+def job_array(prio, case_config, variable, values):
+    """ Creates a job array, one job per value, with the context variable set to that value. The first job ID is the array ID. """
+    template = Job(prio, case_config, jid = 0)
+    jobs = []
+    for value in values:
+        jid = generate_jid()
+        array_id = jobs[0].jid if jobs else jid
+        jobs.append(ArrayJob(prio, template, array_id, {variable : value}, jid))
+    return jobs
+
 class JobQueue:
-    """ Implementation of a Queue, neither thread safe nor efficient. """
-    
-    _queue = []
-    _stopqueue_event = threading.Event()
-    _poll_thread = threading.Thread()
+    """ Implementation of a thread safe Queue. All modifications are done while holding a lock, readers take a snapshot under the lock
+    and do the expensive work, like sorting and building dictionaries, after releasing it.
+    Queued jobs are kept in a heap ordered by priority and job id, all jobs in a dictionary indexed by the job id.
+    Changing the priority or deleting a job leaves a stale entry in the heap which is skipped when popping.
+    Up to slots jobs are run at the same time, each one gets its own port starting from slave_port.
+    If slave_port is 0 each slave chooses a free port itself. If socket_dir is given, the slaves listen on Unix domain sockets
+    in that directory instead, named after the job id.
+    The sum of the cores requested by the running jobs does not exceed cores, which defaults to the number of CPUs.
+    Jobs of lower priority are started on idle cores while the job with the highest priority does not fit, but at most
+    max_backfill of them. Then the cores are reserved for that job, so a stream of small jobs can't starve it.
+    If a jobstore.JobStore is given, all changes are persisted to it.
+    The status of running jobs is fetched from their slaves every status_interval seconds by a background thread.
+    The queue is driven by its own thread, or if an eventloop.EventLoop is given, all scheduling runs within that loop.
+    Exits of jobs are then handed over to the loop as well. """
 
-    def start_next(self):
-        """ Launches the next job in the queue. """
-        self.sort()
-        queued = [i for i in self._queue if i.state == ST_QUEUED]
-        if queued:
-            queued[0].run()
-            return queued[0].jid
+    max_backfill = 10 # Jobs started past a blocked job with the highest priority before its cores are reserved
+
+    def __init__(self, slots = 1, slave_port = 18001, cores = 0, store = None, status_interval = 2, loop = None, socket_dir = None):
+        self.slots = int(slots)
+        self.slave_port = int(slave_port)
+        self.socket_dir = socket_dir
+        self.cores = int(cores) or multiprocessing.cpu_count()
+        self._jobs = {}
+        self._heap = []
+        self._num_queued = 0
+        self._running = {}
+        self._lock = threading.RLock()
+        self.store = store
+        self.status_interval = float(status_interval)
+        self._refresh_event = threading.Event()
+        self._refresh_thread = threading.Thread()
+        self._wakeup_event = threading.Event()
+        self._stopqueue_event = threading.Event()
+        self._poll_thread = threading.Thread()
+        self.loop = loop
+        self._loop_started = False
+        self._safety_timer = False
+        self._blocked = None # Job ID of the job with the highest priority while it does not fit
+        self._backfilled = 0 # Jobs started past it
+
+    def _in_loop(self, func):
+        """ Returns func, wrapped to be run in the event loop if the queue is driven by one. """
+        if self.loop is None:
+            return func
+        return lambda *args: self.loop.call_soon(func, *args)
+
+    def _wakeup(self):
+        """ Lets the scheduler fill the free slots. """
+        if self.loop:
+            self.loop.call_soon(self._loop_schedule)
         else:
-            return False
-    
-    def sort(self, reverse = False):
-        """ Sort by priority """
-        self._queue.sort(key = lambda a: (a.state, -a.prio), reverse=reverse) 
-        
+            self._wakeup_event.set()
+
+    def _save(self, job):
+        if self.store:
+            self.store.save(job)
+
+    def _push(self, job):
+        """ Pushes a heap entry for the job, the lock must be held. """
+        heapq.heappush(self._heap, (-job.prio, job.jid))
+        if len(self._heap) > 2 * self._num_queued + 64:
+            # Too many stale entries, rebuild the heap from the valid ones
+            self._heap = [e for e in self._heap if self._valid(e)]
+            heapq.heapify(self._heap)
+
+    def _valid(self, entry):
+        """ Returns the job of a heap entry, None if the entry is stale. """
+        prio, jid = entry
+        job = self._jobs.get(jid)
+        if job is not None and job.state == ST_QUEUED and job.prio == -prio:
+            return job
+        return None
+
+    def free_port(self):
+        """ Returns a slave port not used by any running job, None if all slots are occupied. """
+        if self.slave_port == 0 or self.socket_dir:
+            return 0 if len(self.running_jobs()) < self.slots else None
+        used = [job.slave_port for job in self.running_jobs()]
+        for port in range(self.slave_port, self.slave_port + self.slots):
+            if port not in used:
+                return port
+        return None
+
+    def free_cores(self):
+        """ Returns the number of cores not used by running jobs. """
+        return self.cores - sum(job.cores for job in self.running_jobs())
+
+    def start_next(self):
+        """ Launches the job with the highest priority that fits on the free cores.
+        If it does not fit, smaller jobs with lower priority are started to fill up idle cores, up to max_backfill of them.
+        A job requesting more cores than available at all is started when no other job is running. """
+        with self._lock:
+            port = self.free_port()
+            if port is None:
+                return False
+
+            free = self.free_cores()
+            idle = not self._running
+            skipped = []
+            started = False
+            try:
+                while self._heap:
+                    entry = heapq.heappop(self._heap)
+                    job = self._valid(entry)
+                    if job is None:
+                        continue
+                    if job.cores <= free or idle:
+                        self._launch(job, port)
+                        if skipped:
+                            self._backfilled += 1
+                        started = job.jid
+                        break
+                    skipped.append(entry)
+                    if len(skipped) == 1:
+                        if self._blocked != job.jid:
+                            self._blocked, self._backfilled = job.jid, 0
+                        if self._backfilled >= self.max_backfill:
+                            break # Its cores are reserved
+            finally:
+                for entry in skipped:
+                    heapq.heappush(self._heap, entry)
+            return started
+
+    def _launch(self, job, port):
+        """ Runs a job popped from the heap, the lock must be held. If the slave can't be started, e.g. because flof.py
+        is not found, the job is marked as failed and the exception is re-raised. """
+        address = os.path.join(self.socket_dir, "slave-%i.sock" % job.jid) if self.socket_dir else port
+        self._num_queued -= 1
+        job.slave_port = address # Taken by free_port for the next slot, before the slave has reported it
+        try:
+            job.run(address)
+        except Exception:
+            job.slave_port = None
+            job._state = ST_FAILED
+            self._save(job)
+            raise
+        self._running[job.jid] = job
+        self._save(job)
+        self._start_refresh()
+
+    def _add(self, job):
+        job.on_ready = self._in_loop(self._save)
+        job.on_exit = self._in_loop(self._job_exited)
+        self._jobs[job.jid] = job
+        if job.state == ST_QUEUED:
+            self._num_queued += 1
+            self._push(job)
+        elif job.state == ST_RUNNING:
+            self._running[job.jid] = job
+            self._start_refresh()
+
     def put(self, job):
-        self._queue.append(job)
-        logger.debug("Job %s addded to queue", job.as_dict())
-        return job.jid
+        with self._lock:
+            self._add(job)
+            self._save(job)
+            logger.debug("Job %s added to queue: %s", job.jid, job.case_config)
+            self._wakeup()
+            return job.jid
+
+    def put_many(self, jobs):
+        """ Puts a list of jobs in the queue. Returns the list of job IDs. """
+        with self._lock:
+            for job in jobs:
+                self._add(job)
+                self._save(job)
+            logger.debug("%i jobs added to queue", len(jobs))
+            self._wakeup()
+            return [job.jid for job in jobs]
+
+    def _job_exited(self, job):
+        """ Called from the waiter thread of a job. Frees its slot and wakes up the queue. """
+        with self._lock:
+            self._running.pop(job.jid, None)
+            if job.jid in self._jobs: # Don't bring back a deleted job into the store
+                self._save(job)
+        self._wakeup()
+
+    def _start_refresh(self):
+        """ Wakes up the status refresh thread, starts it on first use. """
+        self._refresh_event.set()
+        if not self._refresh_thread.is_alive():
+            self._refresh_thread = threading.Thread(target=self._refresh_status)
+            self._refresh_thread.daemon = True
+            self._refresh_thread.start()
+
+    def _refresh_status(self):
+        """ Refreshes the cached status of all running jobs periodically. Sleeps while no job is running. """
+        while True:
+            self._refresh_event.clear()
+            running = self.running_jobs()
+            for job in running:
+                job.refresh_status()
+            if running:
+                time.sleep(self.status_interval)
+            else:
+                self._refresh_event.wait()
+
+    def restore(self):
+        """ Reloads the jobs from the store. Running jobs whose slave is still alive are re-attached,
+        those that died together with the previous flofserver are marked as failed. """
+        global generate_jid
+        with self._lock:
+            max_jid = 0
+            templates = {}
+            for jid, prio, config, state, pid, address, context, array_id in self.store.load():
+                if array_id is None:
+                    job = Job(prio, config, jid)
+                else:
+                    template = templates.setdefault(array_id, Job(prio, config, jid = 0))
+                    job = ArrayJob(prio, template, array_id, context, jid)
+                max_jid = max(max_jid, jid)
+                if state == ST_RUNNING and pid and process_alive(pid):
+                    logger.info("Re-attaching to job %s, pid %i.", jid, pid)
+                    job.attach(pid, address)
+                elif state == ST_RUNNING:
+                    logger.warning("Job %s was orphaned by a previous flofserver, marking it as failed.", jid)
+                    job._state = ST_FAILED
+                else:
+                    job._state = state
+                self._add(job)
+                if job.state != state:
+                    self._save(job)
+
+            generate_jid = itertools.count(max_jid + 1).next
+            logger.info("Restored %i jobs from %s.", len(self._jobs), self.store.path)
             
     def delete(self, jid):
-        """ Delete the specified job. """
-        for n, i in enumerate(self._queue):
-            if i.jid == int(jid):
-                del self._queue[n]
-                logger.info("Job %s deleted." % jid)
-                return jid
-            
-        logger.warning("Trying to delete non-existent job %s." % jid)
-        return 0
+        """ Delete the specified job. A running job is aborted, it keeps its slot and cores until its slave has exited. """
+        with self._lock:
+            job = self._jobs.pop(int(jid), None)
+            if job is None:
+                logger.warning("Trying to delete non-existent job %s." % jid)
+                return 0
+
+            if job.state == ST_QUEUED:
+                self._num_queued -= 1
+            if self.store:
+                self.store.delete(job.jid)
+            logger.info("Job %s deleted." % jid)
+        if job.state == ST_RUNNING:
+            self._abort(job)
+        return jid
 
     def abort(self, jid):
         """ Aborts the job with the job id jid. """
-        for i in self._queue:
-            if i.jid == int(jid):
-                logger.info("Job %s aborted.", jid)
-                i.abort()
+        job = self._jobs.get(int(jid))
+        if job is not None:
+            logger.info("Job %s aborted.", jid)
+            self._abort(job)
+
+    def _abort(self, job):
+        if self.loop:
+            # Don't block the loop on the call to the slave
+            threading.Thread(target=job.abort).start()
+        else:
+            job.abort()
 
     def reprio(self, jid, new_prio):
         """ Change the priority of the given job. """
-        for i in self._queue:
-            if i.jid == int(jid):
-                i.prio = int(new_prio)
-                self.sort
-                logger.info("Priority of job %s changed to %s.", jid, new_prio)
-                return i.jid
-        return -1
+        with self._lock:
+            job = self._jobs.get(int(jid))
+            if job is None:
+                return -1
+
+            changed = job.prio != int(new_prio)
+            job.prio = int(new_prio)
+            if job.state == ST_QUEUED and changed: # The entry of an unchanged priority is still valid
+                self._push(job)
+            self._save(job)
+            logger.info("Priority of job %s changed to %s.", jid, new_prio)
+            return job.jid
                 
-    def as_dict(self):
-        """ Returns the entire queue as a list of jobs. Each job is represented by a dictionary. """
-        self.sort()
-        return [i.as_dict() for i in self._queue]
+    def _select(self, state = None, min_prio = None):
+        """ Returns a snapshot of the jobs with the given state and at least priority min_prio, None matches all.
+        The snapshot is a list of tuples (state, -prio, jid, job) which sorts like the queue is listed. """
+        with self._lock:
+            jobs = [(i.state, -i.prio, i.jid, i) for i in self._jobs.itervalues()]
+        if state is not None:
+            jobs = [i for i in jobs if i[0] == int(state)]
+        if min_prio is not None:
+            jobs = [i for i in jobs if -i[1] >= int(min_prio)]
+        return jobs
+
+    def as_dict(self, offset = 0, limit = None, state = None, min_prio = None):
+        """ Returns the queue as a list of jobs, ordered by state and priority. Each job is represented by a dictionary.
+        Only jobs with the given state and at least priority min_prio are listed, limit jobs at most, starting at offset. """
+        jobs = self._select(state, min_prio)
+        offset = int(offset)
+        if limit is None:
+            jobs = sorted(jobs)[offset:]
+        else:
+            jobs = heapq.nsmallest(offset + int(limit), jobs)[offset:]
+        return [i[3].as_dict() for i in jobs]
+
+    def count(self, state = None, min_prio = None):
+        """ Returns the number of jobs with the given state and at least priority min_prio. """
+        return len(self._select(state, min_prio))
+
+    def array_status(self, array_id):
+        """ Returns the number of jobs of the job array per state name, e.g. {"Queued" : 10, "Running" : 2}. """
+        array_id = int(array_id)
+        with self._lock:
+            states = [i.state for i in self._jobs.itervalues() if i.array_id == array_id]
+        status = {}
+        for state in states:
+            name = common.state2str(state)
+            status[name] = status.get(name, 0) + 1
+        return status
 
     def running_jobs(self):
         """ Lists all currently running jobs. """
-        return [job for job in self._queue if job.state == ST_RUNNING]
+        with self._lock:
+            return self._running.values()
 
 
     def start(self):
         """ Starts the queue. """
-        if self._poll_thread.is_alive():
+        if self.state() == ST_RUNNING:
             logger.warning("Queue already started.")
             return False
+        elif self.loop:
+            self._loop_started = True
+            self._wakeup()
+            if not self._safety_timer:
+                self._safety_timer = True
+                self.loop.call_later(10, self._loop_safety_net)
         else:
             self._stopqueue_event.clear()
             self._poll_thread = threading.Thread(target=self._poll_queue)
             self._poll_thread.daemon = True
             self._poll_thread.start()
-            logger.info("Queue started.")
-            return True
+        logger.info("Queue started.")
+        return True
 
     def stop(self):
         """ Stops the queue. Does not affect running jobs. """
-        self._stopqueue_event.set()
-        logger.info("Stopping queue.")
+        if self.loop:
+            self._loop_started = False
+            logger.info("Queue stopped")
+        else:
+            self._stopqueue_event.set()
+            self._wakeup_event.set()
+            logger.info("Stopping queue.")
         return True
 
     def state(self):
         """ Returns the state of the queue, either ST_RUNNING or ST_STOPPED. """
-        if self._poll_thread.is_alive():
+        if self._loop_started or self._poll_thread.is_alive():
             return ST_RUNNING
         else:
             return ST_STOPPED
+
+    def _fill_slots(self):
+        """ Starts jobs until all slots are occupied or no queued job fits. """
+        while len(self.running_jobs()) < self.slots:
+            try:
+                if not self.start_next():
+                    break
+            except Exception:
+                logger.exception("Starting a job failed, it has been marked as failed.")
+
+    def _loop_schedule(self):
+        if self._loop_started:
+            self._fill_slots()
+
+    def _loop_safety_net(self):
+        """ Fills the slots every 10 seconds, in case a wakeup got lost. """
+        self._safety_timer = self._loop_started
+        if self._loop_started:
+            self._fill_slots()
+            self.loop.call_later(10, self._loop_safety_net)
     
     def _poll_queue(self):
-        """ Checks for jobs to run. If the event is set, the threads exits and the queue has stopped
-        Otherwise it will wait for timeout 10 seconds. """
+        """ Fills all free slots with jobs to run. Afterwards it sleeps until a job is put into the queue, a job exits
+        or the queue is stopped. The timeout of 10 seconds is just a safety net. If the stop event is set, the threads exits and the queue has stopped. """
 
-        # second isSet() test is needed since python <2.7 returns always None from wait()
-        while not self._stopqueue_event.wait(10) and not self._stopqueue_event.isSet():
-            if not self.running_jobs():
-                self.start_next()
+        while not self._stopqueue_event.is_set():
+            self._wakeup_event.clear()
+            self._fill_slots()
+            self._wakeup_event.wait(10)
 
         logger.info("Queue stopped")
 
@@ -0,0 +1,90 @@
+import json, logging, os, Queue, sqlite3, threading
+
+logger = logging.getLogger(__name__)
+
+from common import norm_path
+
+
+class JobStore:
+    """ Persistent storage of the job queue in a SQLite database in WAL mode.
+    Writes are handed over to a writer thread which commits everything that has accumulated in one transaction (group commit),
+    so enqueueing does not wait for the disk. flush blocks until all writes have been committed. """
+
+    def __init__(self, path):
+        self.path = norm_path(path)
+        dbdir = os.path.dirname(self.path)
+        if not os.path.isdir(dbdir):
+            os.makedirs(dbdir)
+
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS jobs (jid INTEGER PRIMARY KEY, prio INTEGER, config TEXT,
+                                                          state INTEGER, pid INTEGER, slave_port INTEGER,
+                                                          context TEXT, array_id INTEGER)""")
+        columns = [i[1] for i in conn.execute("PRAGMA table_info(jobs)")]
+        for column, sql_type in [("context", "TEXT"), ("array_id", "INTEGER")]:
+            if column not in columns: # Store of an older version
+                conn.execute("ALTER TABLE jobs ADD COLUMN %s %s" % (column, sql_type))
+        conn.commit()
+        conn.close()
+
+        self._pending = Queue.Queue()
+        self._writer_thread = threading.Thread(target=self._writer)
+        self._writer_thread.daemon = True
+        self._writer_thread.start()
+
+    def _writer(self):
+        """ Executes the pending writes, committing them in batches. Exits on a None item. """
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        running = True
+        while running:
+            batch = [self._pending.get()]
+            while True:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except Queue.Empty:
+                    break
+            try:
+                for op in batch:
+                    if op is None:
+                        running = False
+                    else:
+                        conn.execute(*op)
+                conn.commit()
+            except sqlite3.Error:
+                logger.exception("Writing %i operations to the job store failed.", len(batch))
+                conn.rollback()
+            for op in batch:
+                self._pending.task_done()
+        conn.close()
+
+    def save(self, job):
+        """ Inserts the job or updates all its fields. """
+        context = json.dumps(job.context) if job.context else None
+        self._pending.put( ("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (job.jid, job.prio, job.case_config, job.state, job.pid, job.slave_port, context, job.array_id)) )
+
+    def delete(self, jid):
+        """ Removes the job from the store. """
+        self._pending.put( ("DELETE FROM jobs WHERE jid = ?", (int(jid),)) )
+
+    def load(self):
+        """ Returns all stored jobs as a list of tuples (jid, prio, config, state, pid, slave_port, context, array_id), ordered by jid. """
+        self.flush()
+        conn = sqlite3.connect(self.path)
+        try:
+            rows = conn.execute("SELECT jid, prio, config, state, pid, slave_port, context, array_id FROM jobs ORDER BY jid").fetchall()
+        finally:
+            conn.close()
+        return [row[:6] + (json.loads(row[6]) if row[6] else {}, row[7]) for row in rows]
+
+    def flush(self):
+        """ Blocks until all pending writes are committed. """
+        self._pending.join()
+
+    def close(self):
+        """ Commits all pending writes and stops the writer thread. """
+        if self._writer_thread.is_alive():
+            self._pending.put(None)
+            self._writer_thread.join()
@@ -0,0 +1,168 @@
+""" A compact RPC transport as an alternative to XML-RPC. Messages are JSON documents, each prefixed by its length as
+a 4 byte unsigned integer in network byte order. A request is {"method": name, "params": [...]}, the response either
+{"result": value} or {"error": message}. Connections are persistent, a client sends any number of requests over it.
+The servers listen on a TCP port or, if the address is a path, on a Unix domain socket. """
+
+import asynchat, asyncore, json, logging, os, socket, struct, threading
+
+logger = logging.getLogger(__name__)
+
+from SimpleXMLRPCServer import SimpleXMLRPCDispatcher
+from SocketServer import StreamRequestHandler, TCPServer, ThreadingMixIn, UnixStreamServer
+
+_header = struct.Struct("!I")
+
+
+class Fault(Exception):
+    """ Raised by the ServerProxy if the called method raised an exception on the server. """
+    pass
+
+
+def dispatch(dispatcher, data):
+    """ Decodes a request, calls the method through a SimpleXMLRPCDispatcher and returns the encoded response. """
+    try:
+        request = json.loads(data)
+        response = {"result" : dispatcher._dispatch(request["method"], request.get("params", []))}
+    except Exception as e:
+        response = {"error" : "%s: %s" % (e.__class__.__name__, e)}
+    return json.dumps(response, separators=(",", ":"))
+
+
+class _RequestHandler(StreamRequestHandler):
+    """ Answers requests until the client closes the connection. """
+
+    def handle(self):
+        while True:
+            header = self.rfile.read(_header.size)
+            if len(header) < _header.size:
+                break
+            data = self.rfile.read(_header.unpack(header)[0])
+            response = dispatch(self.server, data)
+            self.wfile.write(_header.pack(len(response)) + response)
+            self.wfile.flush()
+
+
+class ThreadedJSONRPCServer(ThreadingMixIn, TCPServer, SimpleXMLRPCDispatcher):
+    """ JSON-RPC server with a thread per connection. Functions and instances are registered like at a SimpleXMLRPCServer. """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, addr, allow_none=True):
+        SimpleXMLRPCDispatcher.__init__(self, allow_none, None)
+        TCPServer.__init__(self, addr, _RequestHandler)
+
+
+class ThreadedUnixJSONRPCServer(ThreadingMixIn, UnixStreamServer, SimpleXMLRPCDispatcher):
+    """ JSON-RPC server listening on a Unix domain socket, a thread per connection. A stale socket file at path is replaced. """
+    daemon_threads = True
+
+    def __init__(self, path, allow_none=True):
+        SimpleXMLRPCDispatcher.__init__(self, allow_none, None)
+        if os.path.exists(path):
+            os.unlink(path)
+        UnixStreamServer.__init__(self, path, _RequestHandler)
+
+    def server_close(self):
+        UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+class _JSONRPCChannel(asynchat.async_chat):
+    """ A connection to the AsyncJSONRPCServer. """
+
+    def __init__(self, sock, server):
+        asynchat.async_chat.__init__(self, sock, server.loop.map)
+        self.server = server
+        self._buffer = []
+        self._length = None
+        self.set_terminator(_header.size)
+
+    def collect_incoming_data(self, data):
+        self._buffer.append(data)
+
+    def found_terminator(self):
+        data = "".join(self._buffer)
+        self._buffer = []
+        if self._length is None:
+            self._length = _header.unpack(data)[0]
+            if self._length > 0:
+                self.set_terminator(self._length)
+                return
+            data = ""
+        response = dispatch(self.server, data)
+        self.push(_header.pack(len(response)) + response)
+        self._length = None
+        self.set_terminator(_header.size)
+
+    def handle_error(self):
+        logger.exception("Error on JSON-RPC connection, closing it.")
+        self.close()
+
+
+class AsyncJSONRPCServer(asyncore.dispatcher, SimpleXMLRPCDispatcher):
+    """ JSON-RPC server that handles all connections within an eventloop.EventLoop. """
+
+    def __init__(self, addr, loop):
+        asyncore.dispatcher.__init__(self, map=loop.map)
+        SimpleXMLRPCDispatcher.__init__(self, True, None)
+        self.loop = loop
+        self._path = addr if isinstance(addr, basestring) else None
+        if self._path:
+            if os.path.exists(addr):
+                os.unlink(addr)
+            self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.set_reuse_addr()
+        self.bind(addr)
+        self.listen(socket.SOMAXCONN)
+        self.server_address = self.socket.getsockname()
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            _JSONRPCChannel(pair[0], self)
+
+    def close(self):
+        asyncore.dispatcher.close(self)
+        if self._path and os.path.exists(self._path):
+            os.unlink(self._path)
+
+
+class ServerProxy:
+    """ Client of a JSON-RPC server, methods are called like on a xmlrpclib.ServerProxy.
+    The connection is opened on creation and reused for all calls. It may be shared between threads.
+    If socket_path is given, the proxy connects to that Unix domain socket instead of host and port. """
+
+    def __init__(self, host=None, port=None, timeout=None, socket_path=None):
+        if socket_path:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.settimeout(timeout)
+            self._sock.connect(socket_path)
+        else:
+            self._sock = socket.create_connection((host, port), timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._rfile = self._sock.makefile("rb")
+        self._lock = threading.Lock()
+
+    def _call(self, method, params):
+        request = json.dumps({"method" : method, "params" : params}, separators=(",", ":"))
+        with self._lock:
+            self._sock.sendall(_header.pack(len(request)) + request)
+            header = self._rfile.read(_header.size)
+            if len(header) < _header.size:
+                raise socket.error("Connection closed by the server.")
+            response = json.loads(self._rfile.read(_header.unpack(header)[0]))
+        if "error" in response:
+            raise Fault(response["error"])
+        return response["result"]
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+        return lambda *params: self._call(method, params)
+
+    def close(self):
+        self._rfile.close()
+        self._sock.close()
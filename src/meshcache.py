@@ -0,0 +1,132 @@
+""" A content addressed cache of OpenFOAM meshes, shared by all cases of a user. An entry is a polyMesh directory, stored under
+a key that is a hash of the files the mesh was created from and of the arguments and version of the tool that created it. """
+
+import errno, hashlib, logging, os, shutil, subprocess, tempfile, time
+
+logger = logging.getLogger(__name__)
+
+from common import norm_path
+
+
+class MeshCache:
+    """ Cache of polyMesh directories in path, holding at most max_size bytes. When it grows larger, the least recently used
+    entries are removed. An entry is materialized in a case by hardlinking or by copying its files.
+    Hardlinked files are shared between the cache and all cases using them, so the files in the cache are read-only:
+    a tool that tries to modify the mesh in place fails, instead of changing the mesh of all other cases. """
+
+    def __init__(self, path = "~/.flof/cache/mesh", max_size = 10 * 1024**3):
+        self.path = norm_path(path)
+        self.max_size = max_size
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def key(self, files, *args):
+        """ Returns the key for a mesh created from files (or directories) with the given arguments, e.g. the tool, its arguments and version. """
+        h = hashlib.sha1(repr(args))
+        for path in files:
+            path = norm_path(path)
+            if os.path.isdir(path):
+                names = sorted(os.path.join(d, f) for d, dirs, fs in os.walk(path) for f in fs)
+            else:
+                names = [path]
+            for name in names:
+                h.update("\0%s\0" % os.path.relpath(name, path))
+                with open(name, "rb") as f:
+                    for block in iter(lambda: f.read(1 << 20), ""):
+                        h.update(block)
+        return h.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.path, key)
+
+    def fetch(self, key, target, link = "hardlink"):
+        """ Materializes the entry at target, which must not exist. link is either hardlink or copy, which makes a
+        reflink copy where the file system supports it. Hardlinks fall back to a copy if the cache and target are on different
+        file systems. Returns False if there is no such entry. """
+        entry = self._entry(key)
+        if not os.path.isdir(entry):
+            return False
+        try:
+            os.utime(entry, None) # Marks the entry as used
+            if link == "hardlink":
+                try:
+                    _link_tree(entry, target)
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    logger.info("Mesh cache and %s are on different file systems, copying instead of hardlinking.", target)
+                    shutil.rmtree(target, ignore_errors = True)
+                    _copy_tree(entry, target)
+            else:
+                _copy_tree(entry, target)
+        except (IOError, OSError) as e:
+            # Removed by a concurrent eviction or a file system without hardlinks
+            logger.warning("Materializing mesh %s from the cache failed: %s", key, e)
+            shutil.rmtree(target, ignore_errors = True)
+            return False
+        logger.info("Mesh %s taken from the cache.", key)
+        return True
+
+    def store(self, key, source):
+        """ Stores a copy of the mesh directory source under key, then evicts entries if the cache has grown too large. """
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            return
+        tmp = tempfile.mkdtemp(prefix = ".tmp-", dir = self.path)
+        try:
+            os.rmdir(tmp)
+            shutil.copytree(source, tmp)
+            for d, dirs, files in os.walk(tmp):
+                for f in files:
+                    os.chmod(os.path.join(d, f), 0444)
+            os.rename(tmp, entry)
+            logger.info("Mesh %s stored in the cache.", key)
+        except OSError as e:
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY): # Otherwise stored concurrently by another process
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors = True)
+        self.evict()
+
+    def entries(self):
+        """ Returns a list of (last use, size in bytes, key) of all entries, the least recently used first. """
+        entries = []
+        for key in os.listdir(self.path):
+            entry = self._entry(key)
+            if key.startswith(".tmp-") or not os.path.isdir(entry):
+                continue
+            size = sum(os.lstat(os.path.join(d, f)).st_size for d, dirs, files in os.walk(entry) for f in files)
+            entries.append( (os.stat(entry).st_mtime, size, key) )
+        return sorted(entries)
+
+    def evict(self):
+        """ Removes the least recently used entries until the cache holds at most max_size bytes. """
+        entries = self.entries()
+        total = sum(size for used, size, key in entries)
+        for used, size, key in entries:
+            if total <= self.max_size:
+                break
+            logger.info("Evicting mesh %s from the cache, last used %s.", key, time.ctime(used))
+            shutil.rmtree(self._entry(key), ignore_errors = True)
+            total -= size
+
+
+def _link_tree(src, dst):
+    """ Recreates the directories of src at dst and hardlinks the files. """
+    for d, dirs, files in os.walk(src):
+        target_dir = os.path.join(dst, os.path.relpath(d, src))
+        os.makedirs(target_dir)
+        for f in files:
+            os.link(os.path.join(d, f), os.path.join(target_dir, f))
+
+
+def _copy_tree(src, dst):
+    """ Copies src to dst, using reflinks (copy on write) if the file system supports them. The copies are writable. """
+    if not os.path.isdir(os.path.dirname(dst)):
+        os.makedirs(os.path.dirname(dst))
+    if subprocess.call(["cp", "-R", "--reflink=auto", src, dst]) != 0:
+        shutil.rmtree(dst, ignore_errors = True)
+        shutil.copytree(src, dst)
+    for d, dirs, files in os.walk(dst):
+        for f in files:
+            os.chmod(os.path.join(d, f), 0644)
@@ -0,0 +1,84 @@
+""" Handling of the output of the processes started by the workers. Solvers print millions of lines, so the output is
+handled in chunks: written to the log file as it is read, echoed to the console at a limited rate and split into
+lines only if someone is interested in them. """
+
+import errno, os, time
+
+
+class OutputStream:
+    """ Distributes the output of a process. Chunks passed to feed are appended to logfile unchanged and echoed to echo,
+    e.g. sys.stdout, as long as that does not exceed echo_rate bytes per second on average, with bursts of up to echo_burst bytes.
+    Output exceeding the rate is left out on the console, which continues with the next complete line afterwards.
+    Each consumer is called with every line, without the line break. """
+
+    def __init__(self, logfile = None, echo = None, consumers = [], echo_rate = 16384, echo_burst = 65536):
+        self._log = open(logfile, "ab", 0) if logfile else None
+        self.echo = echo
+        self.consumers = list(consumers)
+        self.echo_rate = echo_rate
+        self.echo_burst = echo_burst
+        self._budget = echo_burst
+        self._last = time.time()
+        self._skipped = 0
+        self._line_start = True # Whether the last echoed byte ended a line
+        self._partial = ""
+
+    def feed(self, chunk):
+        """ Handles the next chunk of output. """
+        if self._log:
+            self._log.write(chunk)
+        if self.echo:
+            self._echo(chunk)
+        if self.consumers:
+            lines = (self._partial + chunk).split("\n")
+            self._partial = lines.pop()
+            for line in lines:
+                for consumer in self.consumers:
+                    consumer(line)
+
+    def _echo(self, chunk):
+        now = time.time()
+        self._budget = min(self.echo_burst, self._budget + (now - self._last) * self.echo_rate)
+        self._last = now
+        if self._skipped:
+            # Resume at the start of a line, once there is enough budget
+            start = chunk.find("\n") + 1
+            if not start or len(chunk) - start > self._budget:
+                self._skipped += len(chunk)
+                return
+            self._skipped += start
+            chunk = "%s[... %i bytes not shown, see the log file ...]\n%s" % ("" if self._line_start else "\n", self._skipped, chunk[start:])
+            self._skipped = 0
+        elif len(chunk) > self._budget:
+            self._skipped = len(chunk)
+            return
+        self._budget -= len(chunk)
+        self._line_start = chunk.endswith("\n")
+        self.echo.write(chunk)
+        self.echo.flush()
+
+    def close(self):
+        """ Passes a last incomplete line to the consumers and closes the log file. """
+        if self._partial:
+            for consumer in self.consumers:
+                consumer(self._partial)
+            self._partial = ""
+        if self.echo and self._skipped:
+            self.echo.write("%s[... %i bytes not shown, see the log file ...]\n" % ("" if self._line_start else "\n", self._skipped))
+            self.echo.flush()
+        if self._log:
+            self._log.close()
+
+
+def pump(fd, stream, chunk_size = 65536):
+    """ Reads from the file descriptor fd until the end of file and feeds the chunks to stream. """
+    while True:
+        try:
+            chunk = os.read(fd, chunk_size)
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        if not chunk:
+            break
+        stream.feed(chunk)
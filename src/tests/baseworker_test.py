@@ -0,0 +1,196 @@
+import logging, os, shutil, tempfile, threading, time, unittest
+import xml.etree.ElementTree as ET
+
+import common
+from workers.baseworker import BaseWorker, ContextManager, WorkerError, WorkerFactory, WorkerRegistry
+from workers.workers import Case, Variation
+
+
+class Step(BaseWorker):
+    """ Records its start and end. Sleeps for its sleep attribute, fails if fail is set and waits until it is aborted if block is set. """
+    events = []
+    lock = threading.Lock()
+
+    def __init__(self, configuration, context):
+        BaseWorker.__init__(self, configuration, context)
+        self._aborted = threading.Event()
+
+    def _record(self, event):
+        with Step.lock:
+            Step.events.append( (event, self.name) )
+
+    def run(self):
+        self.logger.info("Running %s", self.name)
+        self._record("start")
+        if common.getboolean(self.config.get("block", "False")):
+            self._aborted.wait(5)
+        time.sleep(float(self.config.get("sleep", 0)))
+        if common.getboolean(self.config.get("fail", "False")):
+            raise WorkerError("%s failed" % self.name)
+        self._record("end")
+
+    def abort(self):
+        self._aborted.set()
+
+
+class FileStep(Step):
+    """ Records its events with the process id in the file events of the working directory, so they can be seen from other processes. """
+
+    def _record(self, event):
+        with open("events", "a") as f:
+            f.write("%i %s %s\n" % (os.getpid(), event, self.name))
+
+
+def factory(xml):
+    return WorkerFactory(ET.ElementTree(ET.fromstring(xml)), ContextManager({}))
+
+
+class TestDependencies(unittest.TestCase):
+
+    def dependencies(self, xml):
+        f = factory(xml)
+        return f.dependencies(list(f.conf_root))
+
+    def testAfter(self):
+        deps = self.dependencies('<flof><step name="a"/><step name="b" after=""/><step name="c" after="a, b"/><step name="d"/></flof>')
+        self.assertEqual(deps, [set(), set(), set([0, 1]), set([0, 1, 2])])
+
+    def testUnknown(self):
+        self.assertRaises(WorkerError, self.dependencies, '<flof><step name="a"/><step name="b" after="x"/></flof>')
+
+    def testCycle(self):
+        self.assertRaises(WorkerError, self.dependencies, '<flof><step name="a" after="b"/><step name="b" after="a"/></flof>')
+        self.assertRaises(WorkerError, self.dependencies, '<flof><step name="a" after="a"/></flof>')
+
+    def testMeshSource(self):
+        deps = self.dependencies('<flof><case name="coarse"/><case name="fine"/>'
+                                 '<case name="finer"><create><mesh><copy source="fine"/></mesh></create></case></flof>')
+        self.assertEqual(deps, [set(), set(), set([1])])
+
+    def testSameCase(self):
+        """ Cases of the same name are run in document order, even with an after attribute. """
+        deps = self.dependencies('<flof><case name="a"/><case name="b"/><case name="./a"/><case name="a" after="b"/></flof>')
+        self.assertEqual(deps, [set(), set(), set([0]), set([0, 1, 2])])
+
+
+class TestExecuteParallel(unittest.TestCase):
+
+    def setUp(self):
+        WorkerRegistry.register("step", Step)
+        Step.events = []
+
+    def tearDown(self):
+        del WorkerRegistry.workers["step"]
+        WorkerFactory._sig_abort.clear()
+
+    def testOrder(self):
+        factory('<flof parallel="3"><step name="a" sleep="0.1"/><step name="b" after=""/>'
+                '<step name="c" after="a,b"/></flof>').execute()
+        self.assertEqual(Step.events[:2], [("start", "a"), ("start", "b")])
+        self.assertTrue(Step.events.index(("start", "c")) > Step.events.index(("end", "a")))
+
+    def testFailure(self):
+        """ The exception of a failed worker is raised after the running workers have finished, no further workers are started. """
+        f = factory('<flof parallel="2"><step name="a" fail="True"/><step name="b" after="" sleep="0.2"/>'
+                    '<step name="c" after="a"/><step name="d" after="b"/></flof>')
+        self.assertRaises(WorkerError, f.execute)
+        self.assertEqual(sorted(Step.events), [("end", "b"), ("start", "a"), ("start", "b")])
+
+    def testAbort(self):
+        f = factory('<flof parallel="2"><step name="a" block="True"/><step name="b" after="a"/></flof>')
+        thread = threading.Thread(target=f.execute)
+        thread.start()
+        for i in range(100):
+            if Step.events:
+                break
+            time.sleep(0.01)
+        WorkerFactory.abort()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(Step.events, [("start", "a"), ("end", "a")])
+
+    def testParallelVariation(self):
+        """ The parallel attribute of a variation runs the iterations in processes, the subworkers of an iteration one after another. """
+        WorkerRegistry.register("step", FileStep)
+        WorkerRegistry.register("variation", Variation)
+        cwd = os.getcwd()
+        d = tempfile.mkdtemp()
+        os.chdir(d)
+        try:
+            factory('<flof><variation variable="x" range="range(2)" parallel="2">'
+                    '<step name="a" sleep="0.2"/><step name="b" after=""/></variation></flof>').execute()
+            iterations = {}
+            with open("events") as f:
+                for line in f:
+                    pid, event, name = line.split()
+                    iterations.setdefault(pid, []).append( (event, name) )
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(d)
+            del WorkerRegistry.workers["variation"]
+        self.assertEqual(iterations.values(), [[("start", "a"), ("end", "a"), ("start", "b"), ("end", "b")]] * 2)
+
+
+class TestIncremental(unittest.TestCase):
+
+    def setUp(self):
+        WorkerRegistry.register("step", Step)
+        WorkerRegistry.register("case", Case)
+        WorkerFactory.incremental = True
+        Step.events = []
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        os.mkdir("a")
+        os.mkdir("b")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+        del WorkerRegistry.workers["step"]
+        del WorkerRegistry.workers["case"]
+        WorkerFactory.incremental = False
+
+    def testIndependentCases(self):
+        """ A case is not rerun because an unrelated case before it has been run. """
+        xml = '<flof><case name="a"><step name="s" sleep="%s"/></case><case name="b"><step name="s"/></case></flof>'
+        self.assertTrue(factory(xml % 0).execute())
+        Step.events = []
+        self.assertFalse(factory(xml % 0).execute())
+        self.assertEqual(Step.events, [])
+        self.assertTrue(factory(xml % 0.01).execute())
+        self.assertEqual(Step.events, [("start", "s"), ("end", "s")])
+
+
+class TestLogHandlers(unittest.TestCase):
+
+    def setUp(self):
+        WorkerRegistry.register("step", Step)
+        WorkerRegistry.register("case", Case)
+        WorkerRegistry.register("variation", Variation)
+        self.logger = logging.getLogger(Step.__module__ + ".Step")
+        self.logger.setLevel(logging.INFO)
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+        for tag in ["step", "case", "variation"]:
+            del WorkerRegistry.workers[tag]
+        self.logger.setLevel(logging.NOTSET)
+
+    def testLongVariation(self):
+        """ The log file handlers of the workers are released after each iteration. """
+        handlers = len(self.logger.handlers)
+        fds = len(os.listdir("/proc/self/fd"))
+        factory('<flof><variation variable="x" range="range(200)"><case name="case{x}"><step name="s{x}"/></case></variation></flof>').execute()
+        self.assertEqual(len(self.logger.handlers), handlers)
+        self.assertEqual(len(os.listdir("/proc/self/fd")), fds)
+        with open(os.path.join("case199", "log", "step")) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
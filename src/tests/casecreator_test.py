@@ -0,0 +1,36 @@
+import os, shutil, tempfile, unittest
+import xml.etree.ElementTree as ET
+
+from workers.baseworker import ContextManager
+from workers.casecreator import CaseCreator
+
+
+class TestCaseCreator(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.template = os.path.join(self.tmpdir, "template")
+        os.makedirs(os.path.join(self.template, "system"))
+        open(os.path.join(self.template, "system", "controlDict"), "w").close()
+        self.config_file = os.path.join(self.tmpdir, "case.conf")
+        open(self.config_file, "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def worker(self, xml):
+        context = ContextManager({"name" : os.path.join(self.tmpdir, "case"), "config_file" : self.config_file})
+        return CaseCreator(ET.ElementTree(ET.fromstring(xml)), context)
+
+    def testNoMesh(self):
+        """ Without a <mesh> node, no mesh is created. """
+        worker = self.worker('<create template="%s" log="False"><files><directory name="system"><file name=".*"/></directory></files></create>'
+                             % self.template)
+        self.assertEqual(worker.mesh_cache(), None)
+        worker.run()
+        self.assertTrue(os.path.isfile(os.path.join(self.tmpdir, "case", "system", "controlDict")))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "case", "constant")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+import logging, os, shutil, StringIO, tempfile, threading, unittest, xmlrpclib
+
+import common
+
+
+class CountingServer(common.ThreadedXMLRPCServer):
+    """ Counts the accepted connections. """
+    connections = 0
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        common.ThreadedXMLRPCServer.process_request(self, request, client_address)
+
+
+class TestPooledServerProxy(unittest.TestCase):
+
+    def setUp(self):
+        self.server = CountingServer( ("localhost", 0), requestHandler = common.KeepAliveXMLRPCRequestHandler,
+                                      allow_none = True, logRequests = False )
+        self.server.register_function(lambda a, b: a + b, "add")
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.proxy = common.PooledServerProxy("http://localhost:%i/" % self.server.server_address[1], allow_none = True)
+
+    def tearDown(self):
+        self.proxy.close()
+        self.server.shutdown()
+        self.thread.join(1)
+        self.server.server_close()
+
+    def testReuse(self):
+        for i in range(50):
+            self.assertEqual(self.proxy.add(i, 1), i + 1)
+        self.assertEqual(self.server.connections, 1)
+
+    def testFault(self):
+        self.assertRaises(xmlrpclib.Fault, self.proxy.nonexistent)
+        self.assertEqual(self.proxy.add(1, 1), 2)
+
+    def testConcurrent(self):
+        results = []
+        def client(n):
+            results.append(sum(self.proxy.add(n, i) for i in range(20)))
+        threads = [threading.Thread(target=client, args=(n,)) for n in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+        self.assertEqual(sorted(results), [20 * n + 190 for n in range(5)])
+        self.assertTrue(self.server.connections <= 5)
+
+
+class TestUnixSockets(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "test.sock")
+        self.server = common.ThreadedUnixXMLRPCServer(self.path, allow_none = True)
+        self.server.register_function(lambda a, b: a + b, "add")
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join(1)
+        self.server.server_close()
+        self.assertFalse(os.path.exists(self.path))
+        shutil.rmtree(self.tmpdir)
+
+    def testServerProxy(self):
+        proxy = xmlrpclib.ServerProxy("http://localhost/", common.UnixTransport(self.path), allow_none = True)
+        self.assertEqual(proxy.add(1, 2), 3)
+        self.assertRaises(xmlrpclib.Fault, proxy.nonexistent)
+        proxy("close")()
+
+    def testPooledServerProxy(self):
+        proxy = common.PooledServerProxy("http://localhost/", socket_path = self.path, allow_none = True)
+        for i in range(20):
+            self.assertEqual(proxy.add(i, 1), i + 1)
+        proxy.close()
+
+    def testStaleSocket(self):
+        server = common.ThreadedUnixXMLRPCServer(self.path) # Replaces the socket file
+        server.server_close()
+
+    def testRuntimeDir(self):
+        old = os.environ.get("XDG_RUNTIME_DIR")
+        os.environ["XDG_RUNTIME_DIR"] = self.tmpdir
+        try:
+            path = common.runtime_dir()
+        finally:
+            if old is None:
+                del os.environ["XDG_RUNTIME_DIR"]
+            else:
+                os.environ["XDG_RUNTIME_DIR"] = old
+        self.assertEqual(path, os.path.join(self.tmpdir, "flof"))
+        self.assertEqual(os.stat(path).st_mode & 0777, 0700)
+
+
+class TestLogHandlers(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.logger = logging.getLogger("common_test.TestLogHandlers")
+        self.logger.propagate = False
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testShared(self):
+        logfile = os.path.join(self.tmpdir, "log")
+        h1 = common.acquire_log_handler(self.logger, logfile)
+        h2 = common.acquire_log_handler(self.logger, logfile)
+        self.assertIs(h1, h2)
+        self.assertEqual(self.logger.handlers, [h1])
+        self.logger.warning("once")
+        common.release_log_handler(self.logger, logfile)
+        self.assertEqual(self.logger.handlers, [h1])
+        common.release_log_handler(self.logger, logfile)
+        self.assertEqual(self.logger.handlers, [])
+        self.assertEqual(open(logfile).read().count("once"), 1)
+
+    def testLongVariation(self):
+        """ Like a variation of 500 iterations, each with a worker per case and tag, the handler and file descriptor count stays constant. """
+        fds = len(os.listdir("/proc/self/fd")) if os.path.isdir("/proc/self/fd") else None
+        for i in range(500):
+            logfile = os.path.join(self.tmpdir, "case%i" % (i % 5))
+            common.acquire_log_handler(self.logger, logfile)
+            common.acquire_log_handler(self.logger, logfile)
+            self.assertEqual(len(self.logger.handlers), 1)
+            common.release_log_handler(self.logger, logfile)
+            common.release_log_handler(self.logger, logfile)
+        self.assertEqual(self.logger.handlers, [])
+        if fds is not None:
+            self.assertEqual(len(os.listdir("/proc/self/fd")), fds)
+
+
+class TestAsyncHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = StringIO.StringIO()
+        target = logging.StreamHandler(self.stream)
+        target.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        self.handler = common.AsyncHandler([target])
+        self.logger = logging.getLogger("common_test.TestAsyncHandler")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+
+    def testOrder(self):
+        for i in range(1000):
+            self.logger.info("line %i", i)
+        self.handler.flush()
+        self.assertEqual(self.stream.getvalue().splitlines(), ["INFO line %i" % i for i in range(1000)])
+
+    def testArgumentsMerged(self):
+        values = [1]
+        self.logger.info("values %s", values)
+        values.append(2)
+        self.handler.flush()
+        self.assertEqual(self.stream.getvalue(), "INFO values [1]\n")
+
+    def testErrorWritten(self):
+        """ Records of flush_level are written before emit returns, together with the queued ones. """
+        self.logger.info("before")
+        try:
+            raise ValueError("crash")
+        except ValueError:
+            self.logger.exception("failed")
+        lines = self.stream.getvalue().splitlines()
+        self.assertEqual(lines[:2], ["INFO before", "ERROR failed"])
+        self.assertEqual(lines[-1], "ValueError: crash")
+
+    def testClose(self):
+        self.logger.debug("last")
+        self.handler.close()
+        self.assertEqual(self.stream.getvalue(), "DEBUG last\n")
+        self.logger.debug("after close") # Written synchronously
+        self.assertEqual(self.stream.getvalue(), "DEBUG last\nDEBUG after close\n")
+
+    def testFork(self):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            self.logger.info("child")
+            os.write(write_fd, self.stream.getvalue())
+            os._exit(0)
+        os.close(write_fd)
+        os.waitpid(pid, 0)
+        self.assertEqual(os.read(read_fd, 1024), "INFO child\n")
+        os.close(read_fd)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import asyncore, httplib, os, resource, socket, threading, unittest, xmlrpclib
+
+import eventloop, jobqueue
+from common import ST_RUNNING
+from jobqueue_test import FakeJob
+
+
+class TestEventLoop(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = eventloop.EventLoop()
+        self.server = eventloop.AsyncXMLRPCServer( ("localhost", 0), self.loop, allow_none = True )
+        self.server.register_function(lambda a, b: a + b, "add")
+        self.server.register_function(threading.current_thread, "thread")
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        self.url = "http://localhost:%i/" % self.server.server_address[1]
+
+    def tearDown(self):
+        self.loop.stop()
+        self.thread.join(1)
+        self.server.close()
+
+    def add(self, a, b):
+        """ Calls add with a timeout, so a dead loop fails the test instead of blocking it. """
+        conn = httplib.HTTPConnection("localhost", self.server.server_address[1], timeout = 5)
+        conn.request("POST", "/", xmlrpclib.dumps((a, b), "add"))
+        result = xmlrpclib.loads(conn.getresponse().read())[0][0]
+        conn.close()
+        return result
+
+    def testRPC(self):
+        proxy = xmlrpclib.ServerProxy(self.url, allow_none = True)
+        for i in range(20):
+            self.assertEqual(proxy.add(i, 1), i + 1) # Reuses the HTTP/1.1 connection
+        self.assertRaises(xmlrpclib.Fault, proxy.nonexistent)
+
+    def testConcurrentClients(self):
+        results = []
+        def client():
+            proxy = xmlrpclib.ServerProxy(self.url)
+            results.append(sum(proxy.add(i, i) for i in range(10)))
+        clients = [threading.Thread(target=client) for i in range(20)]
+        for c in clients:
+            c.start()
+        for c in clients:
+            c.join(5)
+        self.assertEqual(results, [90] * 20)
+
+    def testHTTP10(self):
+        conn = httplib.HTTPConnection("localhost", self.server.server_address[1])
+        conn._http_vsn, conn._http_vsn_str = 10, "HTTP/1.0"
+        body = xmlrpclib.dumps((2, 3), "add")
+        conn.request("POST", "/", body)
+        response = conn.getresponse()
+        self.assertEqual(xmlrpclib.loads(response.read())[0], (5,))
+        self.assertEqual(response.getheader("connection"), "close")
+
+    def testManyConnections(self):
+        """ More connections than select() can handle, 1024 descriptors. """
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        needed = 2 * 1100 + 100
+        if soft < needed:
+            if hard != resource.RLIM_INFINITY and hard < needed:
+                self.skipTest("Needs %i file descriptors." % needed)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+        clients = []
+        try:
+            for i in range(1100):
+                clients.append(socket.create_connection(("localhost", self.server.server_address[1])))
+            self.assertEqual(self.add(1, 2), 3)
+        finally:
+            for c in clients:
+                c.close()
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    def testBrokenDispatcher(self):
+        """ An exception escaping the poll does not stop the loop. """
+        class Broken(asyncore.file_dispatcher):
+            def readable(self):
+                self.del_channel()
+                raise RuntimeError("broken")
+        r, w = os.pipe()
+        self.loop.call_soon(Broken, r, self.loop.map)
+        self.assertEqual(self.add(1, 2), 3)
+        self.assertTrue(self.thread.is_alive())
+        os.close(r)
+        os.close(w)
+
+    def testCallSoon(self):
+        done = threading.Event()
+        called_from = []
+        self.loop.call_soon(lambda: (called_from.append(threading.current_thread()), done.set()))
+        self.assertTrue(done.wait(1))
+        self.assertEqual(called_from, [self.thread])
+
+    def testQueue(self):
+        """ The queue schedules jobs in the loop, also when a job exits in another thread. """
+        queue = jobqueue.JobQueue(slots = 1, slave_port = 20000, cores = 8, loop = self.loop)
+        first, second = FakeJob(1), FakeJob(1)
+        self.loop.call_soon(queue.start)
+        self.loop.call_soon(queue.put, first)
+        self.loop.call_soon(queue.put, second)
+        self.assertTrue(first.started.wait(1))
+        self.assertFalse(second.started.is_set())
+        threading.Thread(target=first.finish).start()
+        self.assertTrue(second.started.wait(1))
+        self.assertEqual(queue.state(), ST_RUNNING)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,372 @@
+import os, random, shutil, tempfile, threading, time, unittest
+
+import jobqueue
+from common import ST_QUEUED, ST_RUNNING, ST_FINISHED, ST_FAILED
+
+
+class FakeJob(jobqueue.Job):
+    """ A job that does not start flof.py. """
+    
+    def __init__(self, prio, cores = 1):
+        jobqueue.Job.__init__(self, prio, "nonexistent.conf")
+        self.cores = cores
+        self.started = threading.Event()
+        self.info_calls = 0
+        self.aborted = False
+
+    def run(self, port):
+        self._state = ST_RUNNING
+        self.started.set()
+
+    def abort(self, force = False):
+        self.aborted = True
+
+    def worker_info(self):
+        self.info_calls += 1
+        return {"name" : "solve"}
+
+    def finish(self, state = ST_FINISHED):
+        self._state = state
+        self.on_exit(self)
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = jobqueue.JobQueue(slots = 4, slave_port = 20000, cores = 8)
+
+    def testPriority(self):
+        low, high = FakeJob(1), FakeJob(5)
+        self.queue.put(low)
+        self.queue.put(high)
+        self.assertEqual(self.queue.start_next(), high.jid)
+        self.assertEqual(self.queue.start_next(), low.jid)
+        self.assertEqual(low.state, ST_RUNNING)
+
+    def testSlots(self):
+        jobs = [FakeJob(1) for i in range(5)]
+        for job in jobs:
+            self.queue.put(job)
+        self.queue._fill_slots()
+        self.assertEqual(len(self.queue.running_jobs()), 4)
+        self.assertEqual(sorted(job.slave_port for job in self.queue.running_jobs()), [20000, 20001, 20002, 20003])
+
+        jobs[0].finish()
+        self.assertEqual(jobs[0].state, ST_FINISHED)
+        self.assertEqual(self.queue.start_next(), jobs[4].jid)
+        self.assertEqual(jobs[4].slave_port, jobs[0].slave_port)
+
+    def testBackfill(self):
+        parallel, big, serial = FakeJob(10, cores = 6), FakeJob(5, cores = 4), FakeJob(1, cores = 1)
+        for job in [parallel, big, serial]:
+            self.queue.put(job)
+        self.assertEqual(self.queue.start_next(), parallel.jid)
+        # big does not fit on the remaining 2 cores, serial fills them up
+        self.assertEqual(self.queue.start_next(), serial.jid)
+        self.assertFalse(self.queue.start_next())
+        self.assertEqual(big.state, ST_QUEUED)
+
+        parallel.finish()
+        self.assertEqual(self.queue.start_next(), big.jid)
+
+    def testReservation(self):
+        """ After max_backfill smaller jobs, the cores are reserved for the blocked job with the highest priority. """
+        self.queue.max_backfill = 3
+        parallel, big = FakeJob(10, cores = 6), FakeJob(5, cores = 4)
+        small = [FakeJob(1) for i in range(5)]
+        for job in [parallel, big] + small:
+            self.queue.put(job)
+        self.assertEqual(self.queue.start_next(), parallel.jid)
+        for job in small[:3]:
+            self.assertEqual(self.queue.start_next(), job.jid)
+            job.finish()
+        self.assertFalse(self.queue.start_next()) # 2 cores free, but reserved for big
+        parallel.finish()
+        self.assertEqual(self.queue.start_next(), big.jid)
+        self.assertEqual(self.queue.start_next(), small[3].jid)
+
+    def testOversized(self):
+        huge, small = FakeJob(10, cores = 16), FakeJob(1)
+        self.queue.put(huge)
+        self.queue.put(small)
+        self.assertEqual(self.queue.start_next(), huge.jid)
+        self.assertFalse(self.queue.start_next())
+
+    def testReprio(self):
+        jobs = [FakeJob(i) for i in range(5)]
+        for job in jobs:
+            self.queue.put(job)
+        self.assertEqual(self.queue.reprio(jobs[1].jid, 100), jobs[1].jid)
+        self.assertEqual(self.queue.reprio(12345, 100), -1)
+        self.assertEqual(self.queue.start_next(), jobs[1].jid)
+        self.assertEqual(self.queue.start_next(), jobs[4].jid)
+
+    def testDelete(self):
+        jobs = [FakeJob(i) for i in range(3)]
+        for job in jobs:
+            self.queue.put(job)
+        self.assertEqual(self.queue.delete(str(jobs[2].jid)), str(jobs[2].jid))
+        self.assertEqual(self.queue.delete(12345), 0)
+        self.assertEqual(self.queue.start_next(), jobs[1].jid)
+        self.assertEqual(self.queue.start_next(), jobs[0].jid)
+        self.assertFalse(self.queue.start_next())
+
+    def testDeleteRunning(self):
+        """ A deleted running job is aborted and holds its slot until it has exited. """
+        queue = jobqueue.JobQueue(slots = 1, slave_port = 20000, cores = 8)
+        running, queued = FakeJob(2), FakeJob(1)
+        queue.put(running)
+        queue.put(queued)
+        queue.start_next()
+        self.assertEqual(queue.delete(running.jid), running.jid)
+        self.assertTrue(running.aborted)
+        self.assertFalse(queue.start_next())
+        self.assertEqual(queue.free_port(), None)
+        running.finish()
+        self.assertEqual(queue.start_next(), queued.jid)
+        self.assertEqual(queued.slave_port, 20000)
+        self.assertEqual(queue.count(), 1)
+
+    def testAsDict(self):
+        jobs = [FakeJob(i) for i in range(3)]
+        for job in jobs:
+            self.queue.put(job)
+        self.queue.start_next()
+        jobs[2].finish(ST_FAILED)
+        self.queue.start_next()
+        listing = [(i["jid"], i["state"]) for i in self.queue.as_dict()]
+        self.assertEqual(listing, [(jobs[0].jid, ST_QUEUED), (jobs[1].jid, ST_RUNNING), (jobs[2].jid, ST_FAILED)])
+
+    def testPaging(self):
+        jobs = [FakeJob(i) for i in range(10)]
+        for job in jobs:
+            self.queue.put(job)
+        self.queue.start_next()
+        self.assertEqual([i["jid"] for i in self.queue.as_dict(2, 3)], [jobs[6].jid, jobs[5].jid, jobs[4].jid])
+        self.assertEqual([i["jid"] for i in self.queue.as_dict(8)], [jobs[0].jid, jobs[9].jid])
+        self.assertEqual([i["jid"] for i in self.queue.as_dict(state = ST_RUNNING)], [jobs[9].jid])
+        self.assertEqual([i["jid"] for i in self.queue.as_dict(limit = 2, min_prio = 7)], [jobs[8].jid, jobs[7].jid])
+        self.assertEqual(self.queue.count(), 10)
+        self.assertEqual(self.queue.count(ST_QUEUED, 5), 4)
+
+    def testPutMany(self):
+        jobs = [FakeJob(i % 3) for i in range(9)]
+        self.assertEqual(self.queue.put_many(jobs), [job.jid for job in jobs])
+        self.assertEqual(self.queue.count(ST_QUEUED), 9)
+        self.assertEqual(self.queue.start_next(), jobs[2].jid)
+
+    def testManyReprios(self):
+        jobs = [FakeJob(0) for i in range(10)]
+        for job in jobs:
+            self.queue.put(job)
+        for prio in range(1000):
+            self.queue.reprio(jobs[prio % 10].jid, prio)
+        self.assertTrue(len(self.queue._heap) < 100)
+        self.assertEqual(self.queue.start_next(), jobs[9].jid)
+
+    def testStartFailure(self):
+        """ A job whose slave can't be started fails, without occupying a slot or stopping the queue. """
+        broken, other = FakeJob(5), FakeJob(1)
+        def run(port):
+            raise OSError(2, "No such file or directory")
+        broken.run = run
+        self.queue.put(broken)
+        self.queue.put(other)
+        self.assertRaises(OSError, self.queue.start_next)
+        self.assertEqual(broken.state, ST_FAILED)
+        self.assertEqual(self.queue.running_jobs(), [])
+        self.assertEqual(self.queue._num_queued, 1)
+        self.queue._fill_slots()
+        self.assertEqual(self.queue.running_jobs(), [other])
+
+    def testStartFailureThreaded(self):
+        broken, other = FakeJob(5), FakeJob(1)
+        def run(port):
+            raise OSError(2, "No such file or directory")
+        broken.run = run
+        self.queue.start()
+        try:
+            self.queue.put(broken)
+            self.queue.put(other)
+            self.assertTrue(other.started.wait(1))
+            self.assertEqual(self.queue.state(), ST_RUNNING)
+        finally:
+            self.queue.stop()
+            self.queue._poll_thread.join(1)
+
+    def testReprioUnchanged(self):
+        job = FakeJob(3)
+        self.queue.put(job)
+        for i in range(200):
+            self.queue.reprio(job.jid, 3)
+        self.assertEqual(len(self.queue._heap), 1)
+
+    def testEphemeralPorts(self):
+        queue = jobqueue.JobQueue(slots = 2, slave_port = 0, cores = 8)
+        jobs = [FakeJob(1) for i in range(3)]
+        for job in jobs:
+            queue.put(job)
+        self.assertTrue(queue.start_next())
+        self.assertTrue(queue.start_next())
+        self.assertFalse(queue.start_next())
+        self.assertEqual(jobs[0].slave_port, 0)
+
+    def testUnixSockets(self):
+        queue = jobqueue.JobQueue(slots = 2, slave_port = 20000, cores = 8, socket_dir = "/run/flof")
+        jobs = [FakeJob(1) for i in range(3)]
+        for job in jobs:
+            queue.put(job)
+        self.assertTrue(queue.start_next())
+        self.assertTrue(queue.start_next())
+        self.assertFalse(queue.start_next())
+        self.assertEqual(jobs[0].slave_port, "/run/flof/slave-%i.sock" % jobs[0].jid)
+
+    def testReadSocketPath(self):
+        job = FakeJob(1)
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, "/run/flof/slave-1.sock\n")
+        self.assertEqual(job._read_address(read_fd), "/run/flof/slave-1.sock")
+        os.close(write_fd)
+        os.close(read_fd)
+
+    def testReadPort(self):
+        job = FakeJob(1)
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, "123")
+        os.write(write_fd, "45\n")
+        self.assertEqual(job._read_address(read_fd), 12345)
+        os.close(write_fd)
+        self.assertEqual(job._read_address(read_fd), None)
+        os.close(read_fd)
+
+    def testStatusCache(self):
+        queue = jobqueue.JobQueue(slots = 1, slave_port = 20000, cores = 8, status_interval = 60)
+        running, queued = FakeJob(2), FakeJob(1)
+        queue.put(running)
+        queue.put(queued)
+        queue.start_next()
+        for i in range(100):
+            listing = queue.as_dict()
+            if listing[1]["worker_info"]:
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(listing[0]["worker_info"], {})
+        self.assertEqual(listing[1]["worker_info"], {"name" : "solve"})
+        self.assertEqual(running.info_calls, 1) # Listing does not call the slave
+        self.assertEqual(queued.info_calls, 0)
+
+    def testWakeup(self):
+        """ The queue starts jobs immediately when they are put and when a running job exits. """
+        queue = jobqueue.JobQueue(slots = 1, slave_port = 20000, cores = 8)
+        first, second = FakeJob(1), FakeJob(1)
+        queue.start()
+        try:
+            queue.put(first)
+            self.assertTrue(first.started.wait(1))
+            queue.put(second)
+            self.assertFalse(second.started.wait(0.1))
+            first.finish()
+            self.assertTrue(second.started.wait(1))
+        finally:
+            queue.stop()
+            queue._poll_thread.join(1)
+
+
+class TestJobQueueStress(unittest.TestCase):
+    """ Hammers the queue from many threads and checks its invariants afterwards. """
+
+    def setUp(self):
+        self.queue = jobqueue.JobQueue(slots = 4, slave_port = 0, cores = 1000)
+        self.jids = []
+        self.errors = []
+
+    def hammer(self, seed):
+        rand = random.Random(seed)
+        deadline = time.time() + 1
+        try:
+            while time.time() < deadline:
+                action = rand.randint(0, 5)
+                if action == 0:
+                    self.jids.extend(self.queue.put_many([FakeJob(rand.randint(0, 20)) for i in range(5)]))
+                elif action == 1 and self.jids:
+                    self.queue.delete(rand.choice(self.jids))
+                elif action == 2 and self.jids:
+                    self.queue.reprio(rand.choice(self.jids), rand.randint(0, 20))
+                elif action == 3:
+                    listing = self.queue.as_dict(limit = rand.choice([None, 10]))
+                    keys = [(i["state"], -i["prio"], i["jid"]) for i in listing]
+                    self.assertEqual(len(set(keys)), len(keys))
+                elif action == 4:
+                    self.queue.start_next()
+                else:
+                    running = self.queue.running_jobs()
+                    if running:
+                        rand.choice(running).finish()
+        except Exception as e:
+            self.errors.append(e)
+
+    def testInvariants(self):
+        threads = [threading.Thread(target=self.hammer, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.errors, [])
+
+        jobs = self.queue._jobs.values()
+        queued = set(job.jid for job in jobs if job.state == ST_QUEUED)
+        running = set(job.jid for job in jobs if job.state == ST_RUNNING)
+        in_heap = set(self.queue._valid(e).jid for e in self.queue._heap if self.queue._valid(e))
+        self.assertEqual(self.queue._num_queued, len(queued))
+        self.assertEqual(in_heap, queued)
+        # Deleted jobs stay in _running until they have exited
+        self.assertEqual(set(jid for jid in self.queue._running if jid in self.queue._jobs), running)
+        self.assertTrue(all(job.state == ST_RUNNING for job in self.queue._running.values()))
+        self.assertTrue(len(self.queue._running) <= 4)
+        self.assertEqual(self.queue.count(ST_QUEUED), len(queued))
+
+
+class TestJob(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testLazyConfig(self):
+        case_config = os.path.join(self.tmpdir, "case.conf")
+        with open(case_config, "w") as f:
+            f.write('<flof><case name="a"><decompose n="4" /></case><case name="b"><decompose n="2" /></case></flof>')
+
+        job = jobqueue.Job(1, case_config)
+        jobqueue.JobQueue(slots = 1, slave_port = 0, cores = 8).put(job)
+        self.assertEqual(job._cores, None)
+        self.assertEqual(job._config, None)
+        self.assertEqual(job.cores, 4)
+        self.assertEqual(job.as_dict()["config"], case_config)
+        self.assertEqual(job._config, None)
+
+    def testJobArray(self):
+        case_config = os.path.join(self.tmpdir, "case.conf")
+        with open(case_config, "w") as f:
+            f.write('<flof><case name="a"><decompose n="4" /></case></flof>')
+
+        jobs = jobqueue.job_array(3, case_config, "U", [1, 2.5, "x"])
+        self.assertEqual([job.array_id for job in jobs], [jobs[0].jid] * 3)
+        self.assertEqual([job.jid for job in jobs], range(jobs[0].jid, jobs[0].jid + 3))
+        self.assertEqual([job.cores for job in jobs], [4, 4, 4])
+        self.assertTrue(jobs[1].template is jobs[0].template)
+        self.assertEqual(jobs[1].command(0, 5),
+                         ["flof.py", "--no-run", "--port", "0", "--context", "U=2.5", "--ready-fd", "5", case_config])
+
+        queue = jobqueue.JobQueue(slots = 1, slave_port = 0, cores = 8)
+        queue.put_many(jobs)
+        queue.put(FakeJob(1))
+        jobs[0]._state = ST_RUNNING
+        self.assertEqual(queue.array_status(jobs[0].jid), {"Running" : 1, "Queued" : 2})
+        self.assertEqual(queue.array_status(jobs[1].jid), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
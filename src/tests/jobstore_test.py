@@ -0,0 +1,81 @@
+import os, shutil, sqlite3, tempfile, unittest
+
+import jobqueue, jobstore
+from common import ST_QUEUED, ST_FINISHED, ST_FAILED
+from jobqueue_test import FakeJob
+
+
+class TestJobStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "queue.db")
+        self.store = jobstore.JobStore(self.path)
+        self.queue = jobqueue.JobQueue(slots = 2, slave_port = 0, cores = 8, store = self.store)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def restored_queue(self):
+        self.store.close()
+        self.store = jobstore.JobStore(self.path)
+        queue = jobqueue.JobQueue(slots = 2, slave_port = 0, cores = 8, store = self.store)
+        queue.restore()
+        return queue
+
+    def testRestore(self):
+        jobs = [FakeJob(i) for i in range(1000)]
+        for job in jobs:
+            self.queue.put(job)
+        self.queue.reprio(jobs[0].jid, 5000)
+        self.queue.delete(jobs[1].jid)
+
+        queue = self.restored_queue()
+        self.assertEqual(len(queue.as_dict()), 999)
+        self.assertEqual(queue._jobs[jobs[0].jid].prio, 5000)
+        self.assertFalse(jobs[1].jid in queue._jobs)
+        self.assertEqual(queue.as_dict()[0]["jid"], jobs[0].jid)
+        self.assertTrue(FakeJob(1).jid > jobs[-1].jid)
+
+    def testStateTransitions(self):
+        finished, orphaned, queued = FakeJob(3), FakeJob(2), FakeJob(1)
+        for job in [finished, orphaned, queued]:
+            self.queue.put(job)
+        self.queue.start_next()
+        self.queue.start_next()
+        finished.finish()
+
+        queue = self.restored_queue()
+        states = dict((i["jid"], i["state"]) for i in queue.as_dict())
+        self.assertEqual(states, {finished.jid: ST_FINISHED, orphaned.jid: ST_FAILED, queued.jid: ST_QUEUED})
+        self.assertEqual(queue.running_jobs(), [])
+        self.assertEqual(queue._num_queued, 1)
+
+    def testJobArray(self):
+        jobs = jobqueue.job_array(1, "nonexistent.conf", "angle", [0, 15, 30])
+        self.queue.put_many(jobs)
+
+        queue = self.restored_queue()
+        restored = [queue._jobs[job.jid] for job in jobs]
+        self.assertEqual([job.context for job in restored], [{"angle" : 0}, {"angle" : 15}, {"angle" : 30}])
+        self.assertEqual([job.array_id for job in restored], [jobs[0].jid] * 3)
+        self.assertTrue(restored[0].template is restored[2].template)
+        self.assertEqual(queue.array_status(jobs[0].jid), {"Queued" : 3})
+
+    def testUpgrade(self):
+        self.store.close()
+        os.remove(self.path)
+        conn = sqlite3.connect(self.path)
+        conn.execute("""CREATE TABLE jobs (jid INTEGER PRIMARY KEY, prio INTEGER, config TEXT,
+                                           state INTEGER, pid INTEGER, slave_port INTEGER)""")
+        conn.execute("INSERT INTO jobs VALUES (1, 5, '/case.conf', 0, NULL, NULL)")
+        conn.commit()
+        conn.close()
+
+        self.store = jobstore.JobStore(self.path)
+        self.assertEqual(self.store.load(), [(1, 5, "/case.conf", 0, None, None, {}, None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import os, shutil, tempfile, threading, unittest
+
+import eventloop, jsonrpc
+
+
+class Service:
+    def add(self, a, b):
+        return a + b
+
+    def echo(self, value = None):
+        return value
+
+    def fail(self):
+        raise ValueError("failed")
+
+
+class TestThreadedJSONRPC(unittest.TestCase):
+
+    def setUp(self):
+        self.server = jsonrpc.ThreadedJSONRPCServer( ("localhost", 0) )
+        self.server.register_instance(Service())
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.proxy = jsonrpc.ServerProxy("localhost", self.server.server_address[1])
+
+    def tearDown(self):
+        self.proxy.close()
+        self.server.shutdown()
+        self.thread.join(1)
+        self.server.server_close()
+
+    def testCalls(self):
+        for i in range(100):
+            self.assertEqual(self.proxy.add(i, 1), i + 1)
+        self.assertEqual(self.proxy.echo(), None)
+        self.assertEqual(self.proxy.echo({"a" : [1, {"b" : None}]}), {"a" : [1, {"b" : None}]})
+
+    def testErrors(self):
+        self.assertRaises(jsonrpc.Fault, self.proxy.fail)
+        self.assertRaises(jsonrpc.Fault, self.proxy.nonexistent)
+        self.assertEqual(self.proxy.add(1, 1), 2) # The connection is still usable
+
+    def testSharedProxy(self):
+        results = []
+        def client(n):
+            results.append(sum(self.proxy.add(n, i) for i in range(10)))
+        threads = [threading.Thread(target=client, args=(n,)) for n in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+        self.assertEqual(sorted(results), [10 * n + 45 for n in range(10)])
+
+
+class TestAsyncJSONRPC(TestThreadedJSONRPC):
+
+    def setUp(self):
+        self.loop = eventloop.EventLoop()
+        self.server = jsonrpc.AsyncJSONRPCServer( ("localhost", 0), self.loop )
+        self.server.register_instance(Service())
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        self.proxy = jsonrpc.ServerProxy("localhost", self.server.server_address[1])
+
+    def tearDown(self):
+        self.proxy.close()
+        self.loop.stop()
+        self.thread.join(1)
+        self.server.close()
+
+
+class TestUnixJSONRPC(TestThreadedJSONRPC):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "json.sock")
+        self.server = jsonrpc.ThreadedUnixJSONRPCServer(self.path)
+        self.server.register_instance(Service())
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.proxy = jsonrpc.ServerProxy(socket_path = self.path)
+
+    def tearDown(self):
+        TestThreadedJSONRPC.tearDown(self)
+        self.assertFalse(os.path.exists(self.path))
+        shutil.rmtree(self.tmpdir)
+
+
+class TestAsyncUnixJSONRPC(TestAsyncJSONRPC):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "json.sock")
+        self.loop = eventloop.EventLoop()
+        self.server = jsonrpc.AsyncJSONRPCServer(self.path, self.loop)
+        self.server.register_instance(Service())
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        self.proxy = jsonrpc.ServerProxy(socket_path = self.path)
+
+    def tearDown(self):
+        TestAsyncJSONRPC.tearDown(self)
+        self.assertFalse(os.path.exists(self.path))
+        shutil.rmtree(self.tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import errno, os, shutil, tempfile, time, unittest
+
+import meshcache
+
+
+class TestMeshCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = meshcache.MeshCache(os.path.join(self.tmpdir, "cache"), max_size = 2500)
+        self.mesh = os.path.join(self.tmpdir, "mesh.msh")
+        with open(self.mesh, "w") as f:
+            f.write("(0 fluent mesh)")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def polyMesh(self, name, size = 1000):
+        path = os.path.join(self.tmpdir, name, "constant", "polyMesh")
+        os.makedirs(os.path.join(path, "sets"))
+        for f in ["points", "faces", "sets/inlet"]:
+            with open(os.path.join(path, f), "w") as fh:
+                fh.write(name[0] * (size / 3))
+        return path
+
+    def testKey(self):
+        key = self.cache.key([self.mesh], "fluentMeshToFoam", "-writeSets", "2.1.x")
+        self.assertEqual(key, self.cache.key([self.mesh], "fluentMeshToFoam", "-writeSets", "2.1.x"))
+        self.assertNotEqual(key, self.cache.key([self.mesh], "fluentMeshToFoam", "", "2.1.x"))
+        self.assertNotEqual(key, self.cache.key([self.mesh], "fluentMeshToFoam", "-writeSets", "2.2.0"))
+        with open(self.mesh, "a") as f:
+            f.write(" ")
+        self.assertNotEqual(key, self.cache.key([self.mesh], "fluentMeshToFoam", "-writeSets", "2.1.x"))
+        self.assertEqual(self.cache.key([self.polyMesh("a")]), self.cache.key([self.polyMesh("aa")]))
+
+    def testHardlink(self):
+        source = self.polyMesh("a")
+        target = os.path.join(self.tmpdir, "b", "constant", "polyMesh")
+        self.assertFalse(self.cache.fetch("k", target))
+        self.cache.store("k", source)
+        self.assertTrue(self.cache.fetch("k", target))
+        cached = os.path.join(self.cache.path, "k", "sets", "inlet")
+        self.assertTrue(os.path.samefile(cached, os.path.join(target, "sets", "inlet")))
+        if os.getuid() != 0: # root may write anyway
+            self.assertRaises(IOError, open, os.path.join(target, "points"), "w")
+
+    def testHardlinkAcrossFileSystems(self):
+        """ Hardlinking fails with EXDEV if the cache is on another file system, the mesh is copied instead. """
+        source = self.polyMesh("a")
+        target = os.path.join(self.tmpdir, "b", "constant", "polyMesh")
+        self.cache.store("k", source)
+        def link(src, dst):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        os_link, os.link = os.link, link
+        try:
+            self.assertTrue(self.cache.fetch("k", target))
+        finally:
+            os.link = os_link
+        self.assertEqual(open(os.path.join(target, "sets", "inlet")).read(), open(os.path.join(source, "sets", "inlet")).read())
+        self.assertEqual(os.stat(os.path.join(target, "points")).st_nlink, 1)
+
+    def testCopy(self):
+        self.cache.store("k", self.polyMesh("a"))
+        target = os.path.join(self.tmpdir, "b", "constant", "polyMesh")
+        self.assertTrue(self.cache.fetch("k", target, "copy"))
+        self.assertFalse(os.path.samefile(os.path.join(self.cache.path, "k", "points"), os.path.join(target, "points")))
+        with open(os.path.join(target, "points"), "w") as f:
+            f.write("modified")
+        with open(os.path.join(self.cache.path, "k", "points")) as f:
+            self.assertEqual(f.read(), "a" * 333)
+
+    def testEviction(self):
+        self.cache.store("a", self.polyMesh("a"))
+        self.cache.store("b", self.polyMesh("b"))
+        past = time.time() - 100
+        os.utime(os.path.join(self.cache.path, "a"), (past, past))
+        os.utime(os.path.join(self.cache.path, "b"), (past + 1, past + 1))
+        self.assertTrue(self.cache.fetch("a", os.path.join(self.tmpdir, "x"))) # a is now the most recently used one
+        self.cache.store("c", self.polyMesh("c"))
+        self.assertEqual([key for used, size, key in self.cache.entries()], ["a", "c"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os, shutil, StringIO, subprocess, tempfile, unittest
+
+import processoutput
+
+
+class TestOutputStream(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.logfile = os.path.join(self.tmpdir, "solve")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testLogAndLines(self):
+        lines = []
+        stream = processoutput.OutputStream(self.logfile, consumers = [lines.append])
+        for chunk in ["Time = 1\nUx: 0.", "5\n\nTime", " = 2"]:
+            stream.feed(chunk)
+        stream.close()
+        self.assertEqual(lines, ["Time = 1", "Ux: 0.5", "", "Time = 2"])
+        with open(self.logfile) as f:
+            self.assertEqual(f.read(), "Time = 1\nUx: 0.5\n\nTime = 2")
+
+    def testEchoRate(self):
+        echo = StringIO.StringIO()
+        stream = processoutput.OutputStream(echo = echo, echo_rate = 0, echo_burst = 20)
+        stream.feed("0123456789\n")
+        stream.feed("a line too long for the budget\nmore\n")
+        stream._budget = 20 # As if time has passed
+        stream.feed("skipped\nshown\n")
+        stream.feed("dropped\n")
+        stream.close()
+        self.assertEqual(echo.getvalue(), "0123456789\n[... 44 bytes not shown, see the log file ...]\nshown\n"
+                                          "[... 8 bytes not shown, see the log file ...]\n")
+
+    def testPump(self):
+        lines = []
+        stream = processoutput.OutputStream(self.logfile, consumers = [lines.append])
+        popen = subprocess.Popen(["seq", "100000"], stdout = subprocess.PIPE)
+        processoutput.pump(popen.stdout.fileno(), stream)
+        stream.close()
+        self.assertEqual(popen.wait(), 0)
+        self.assertEqual(lines, [str(i) for i in range(1, 100001)])
+        self.assertEqual(os.path.getsize(self.logfile), sum(len(l) + 1 for l in lines))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import math, os, shutil, tempfile, unittest
+
+from foamapi import residualstore
+from foamapi.residualstore import Column, ResidualWriter, open_store
+from foamapi.solverlog import SolverProgress
+
+Step = SolverProgress.Step
+
+
+class TestResidualStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "store")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testAppendFlush(self):
+        w = ResidualWriter(self.path, flush_steps = 2)
+        w.append(Step(0.1, 0.5, 1.0, {"p" : 1.0, "Ux" : 0.5}))
+        self.assertEqual(os.listdir(self.path), [])
+        w.append(Step(0.2, None, 2.0, {"p" : 0.1, "Ux" : 0.05}))
+        self.assertEqual(os.path.getsize(os.path.join(self.path, "time.f8")), 16)
+        w.append(Step(0.3, 0.7, 3.0, {"p" : 0.01, "Ux" : 0.005}))
+        w.close()
+
+        c = Column(os.path.join(self.path, "residual_p.f8"))
+        self.assertEqual(len(c), 3)
+        self.assertEqual(c[0], 1.0)
+        self.assertEqual(c[-1], 0.01)
+        self.assertEqual(c[1:], [0.1, 0.01])
+        self.assertEqual(c[::2], [1.0, 0.01])
+        self.assertRaises(IndexError, c.__getitem__, 3)
+        self.assertTrue(math.isnan(Column(os.path.join(self.path, "courant.f8"))[1]))
+        c.close()
+
+    def testNewField(self):
+        w = ResidualWriter(self.path, flush_steps = 2)
+        for i in range(3):
+            w.append(Step(i, None, None, {"p" : i}))
+        w.append(Step(3, None, None, {"p" : 3, "k" : 30}))
+        w.close()
+        k = Column(os.path.join(self.path, "residual_k.f8"))
+        self.assertEqual(len(k), 4)
+        self.assertTrue(all(math.isnan(v) for v in k[:3]))
+        self.assertEqual(k[3], 30)
+
+    def testContinue(self):
+        w = ResidualWriter(self.path)
+        w.append(Step(1, None, None, {"p" : 1}))
+        w.close()
+        w = ResidualWriter(self.path)
+        self.assertEqual(w.rows, 1)
+        w.append(Step(2, None, None, {"p" : 2, "k" : 20}))
+        w.close()
+        self.assertEqual(Column(os.path.join(self.path, "time.f8"))[:], [1, 2])
+        k = Column(os.path.join(self.path, "residual_k.f8"))
+        self.assertTrue(math.isnan(k[0]))
+        self.assertEqual(k[1], 20)
+
+    def testSolverProgress(self):
+        w = ResidualWriter(self.path)
+        progress = SolverProgress(on_step = w.append)
+        for line in ["Time = 1", "DICPCG:  Solving for p, Initial residual = 0.5, Final residual = 0.1, No Iterations 2",
+                     "Time = 2", "DICPCG:  Solving for p, Initial residual = 0.25, Final residual = 0.1, No Iterations 2",
+                     "End"]:
+            progress.feed(line)
+        w.close()
+        self.assertEqual(progress.count, 2)
+        self.assertEqual(list(open_store(self.path)["residual_p"][:]), [0.5, 0.25])
+
+    def testOpenStoreWithoutNumpy(self):
+        w = ResidualWriter(self.path)
+        w.append(Step(1, 2, 3, {}))
+        w.close()
+        numpy, residualstore.numpy = residualstore.numpy, None
+        try:
+            columns = open_store(self.path)
+        finally:
+            residualstore.numpy = numpy
+        self.assertEqual(sorted(columns), ["courant", "execution_time", "time"])
+        self.assertEqual(columns["execution_time"][0], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+from foamapi.solverlog import SolverProgress
+
+
+LOG = """/*---------------------------------------------------------------------------*\\
+Create time
+
+Starting time loop
+
+Time = 0.005
+
+Courant Number mean: 0 max: 0
+DILUPBiCG:  Solving for Ux, Initial residual = 1, Final residual = 8.90511e-06, No Iterations 19
+DILUPBiCG:  Solving for Uy, Initial residual = 0, Final residual = 0, No Iterations 0
+DICPCG:  Solving for p, Initial residual = 1, Final residual = 0.0492854, No Iterations 12
+time step continuity errors : sum local = 0.000466513, global = -1.79995e-19, cumulative = -1.79995e-19
+DICPCG:  Solving for p, Initial residual = 0.590864, Final residual = 2.65225e-07, No Iterations 35
+ExecutionTime = 0.01 s  ClockTime = 0 s
+
+Time = 0.01
+
+Courant Number mean: 0.0976825 max: 0.585607
+DILUPBiCG:  Solving for Ux, Initial residual = 0.160686, Final residual = 6.83031e-06, No Iterations 19
+DILUPBiCG:  Solving for Uy, Initial residual = 0.260828, Final residual = 9.65939e-06, No Iterations 18
+DICPCG:  Solving for p, Initial residual = 0.428925, Final residual = 0.0103739, No Iterations 22
+ExecutionTime = 0.03 s  ClockTime = 0 s
+
+Time = 0.015
+"""
+
+
+class TestSolverProgress(unittest.TestCase):
+
+    def testParse(self):
+        progress = SolverProgress()
+        self.assertEqual(progress.info(), {})
+        for line in LOG.splitlines():
+            progress.feed(line)
+        self.assertEqual(progress.count, 2)
+        self.assertEqual(progress.steps[0].residuals, {"Ux" : 1.0, "Uy" : 0.0, "p" : 1.0})
+        info = progress.info()
+        self.assertEqual(info["time"], 0.01)
+        self.assertEqual(info["steps"], 2)
+        self.assertEqual(info["courant"], 0.585607)
+        self.assertEqual(info["execution_time"], 0.03)
+        self.assertAlmostEqual(info["step_time"], 0.02)
+        self.assertEqual(info["residuals"], {"Ux" : 0.160686, "Uy" : 0.260828, "p" : 0.428925})
+
+    def testRingBuffer(self):
+        progress = SolverProgress(size = 3)
+        for i in range(10):
+            progress.feed("Time = %i" % i)
+            progress.feed("ExecutionTime = %i s  ClockTime = %i s" % (2 * i, 2 * i))
+        progress.feed("Time = 10")
+        self.assertEqual([step.time for step in progress.steps], [7, 8, 9])
+        self.assertEqual(progress.info()["step_time"], 2)
+        self.assertEqual(progress.count, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!env python2
+""" Compares the XML-RPC and the JSON-RPC transport of the flofserver by calling get_queue on a fake queue,
+and polling the status of a slave with a new connection per call against the pooled keep-alive connections,
+over TCP and over a Unix domain socket. """
+
+import json, optparse, os, shutil, sys, tempfile, threading, time, xmlrpclib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import common, jsonrpc
+
+
+class FakeServer:
+    def __init__(self, size):
+        self.queue = [ {"jid" : i, "prio" : 10, "cores" : 4, "config" : "/home/user/sweep/case_%05i.conf" % i, "state" : 1,
+                        "active_worker" : "solve", "worker_info" : {"name" : "simpleFoam", "time" : 0.125 * i,
+                                                                    "residuals" : {"Ux" : 1e-3, "Uy" : 2e-3, "p" : 5e-2}}}
+                       for i in range(size) ]
+
+    def get_queue(self):
+        return self.queue
+
+
+def measure(call, calls):
+    start = time.time()
+    for i in range(calls):
+        call()
+    return (time.time() - start) / calls
+
+
+def slave_benchmark(calls):
+    """ Returns the time per worker_info call to a slave, first connecting for each call, then with pooled connections. """
+    results = []
+    for handler, proxy_cls in [(common.SimpleXMLRPCRequestHandler, xmlrpclib.ServerProxy),
+                               (common.KeepAliveXMLRPCRequestHandler, common.PooledServerProxy)]:
+        server = common.ThreadedXMLRPCServer( ("localhost", 0), requestHandler = handler, allow_none = True, logRequests=False )
+        server.register_function(lambda: {"name" : "simpleFoam"}, "worker_info")
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        proxy = proxy_cls("http://localhost:%i/" % server.server_address[1], allow_none = True)
+        results.append(measure(proxy.worker_info, calls))
+        if proxy_cls is common.PooledServerProxy:
+            proxy.close()
+        server.shutdown()
+        server.server_close()
+
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "slave.sock")
+    server = common.ThreadedUnixXMLRPCServer(path, allow_none = True)
+    server.register_function(lambda: {"name" : "simpleFoam"}, "worker_info")
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    proxy = common.PooledServerProxy("http://localhost/", socket_path = path, allow_none = True)
+    results.append(measure(proxy.worker_info, calls))
+    proxy.close()
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(tmpdir)
+    return results
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-n", "--size", type="int", default=1000, help="Number of jobs in the queue, default 1000.")
+    parser.add_option("-c", "--calls", type="int", default=50, help="Number of get_queue calls per transport, default 50.")
+    (options, args) = parser.parse_args()
+
+    fake = FakeServer(options.size)
+    xml_server = common.ThreadedXMLRPCServer( ("localhost", 0), allow_none = True, logRequests=False )
+    json_server = jsonrpc.ThreadedJSONRPCServer( ("localhost", 0) )
+    for server in [xml_server, json_server]:
+        server.register_instance(fake)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    xml_proxy = xmlrpclib.ServerProxy("http://localhost:%i/" % xml_server.server_address[1], allow_none = True)
+    json_proxy = jsonrpc.ServerProxy("localhost", json_server.server_address[1])
+
+    xml_bytes = len(xmlrpclib.dumps((fake.queue,), methodresponse=True, allow_none=True))
+    json_bytes = len(json.dumps({"result" : fake.queue}, separators=(",", ":")))
+    xml_time = measure(xml_proxy.get_queue, options.calls)
+    json_time = measure(json_proxy.get_queue, options.calls)
+
+    print "get_queue with %i jobs, %i calls" % (options.size, options.calls)
+    print "{0:10}{1:>15}{2:>15}".format("Transport", "ms per call", "bytes")
+    print "{0:10}{1:>15.2f}{2:>15}".format("XML-RPC", xml_time * 1000, xml_bytes)
+    print "{0:10}{1:>15.2f}{2:>15}".format("JSON-RPC", json_time * 1000, json_bytes)
+
+    json_proxy.close()
+    for server in [xml_server, json_server]:
+        server.shutdown()
+        server.server_close()
+
+    connect_time, pooled_time, unix_time = slave_benchmark(options.calls * 20)
+    print ""
+    print "worker_info on a slave, %i calls" % (options.calls * 20)
+    print "{0:25}{1:>15}".format("Connection", "ms per call")
+    print "{0:25}{1:>15.3f}".format("Connection per call", connect_time * 1000)
+    print "{0:25}{1:>15.3f}".format("Pooled keep-alive", pooled_time * 1000)
+    print "{0:25}{1:>15.3f}".format("Pooled Unix socket", unix_time * 1000)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
-import logging, os, shlex, subprocess, sys
+import hashlib, json, logging, os, Queue, shlex, subprocess, sys, threading
 import xml.etree.ElementTree as ET
 logger = logging.getLogger(__name__)
 
-import common
+import common, processoutput
 from common import norm_path
 
 class ContextManager():
@@ -14,6 +14,12 @@ class ContextManager():
     overrides = {}
     _data = {}
 
+    def clone(self):
+        """ Returns an independent ContextManager with copies of the data and the overrides. """
+        context = ContextManager(self._data.copy())
+        context.overrides = self.overrides.copy()
+        return context
+
     def __getattr__(self, attr):
         if attr in ["update", "__setitem__"]:
             # Attribute calls that modify the dictionary work on the underlying _data dict.
@@ -44,12 +50,26 @@ class WorkerRegistry():
 
     
 class WorkerFactory():
-    def __init__(self, config, context = None):
+    """ Creates the workers from the children of a configuration node and executes them in order.
+    If the node has a parallel="N" attribute, the workers are executed as a graph of dependencies instead, up to N at the same time,
+    each one in its own thread and with its own copy of the context. A worker depends on the sibling workers named in its
+    after attribute, separated by comma. Without an after attribute, a case depends on the cases it copies its mesh from,
+    any other worker on all workers before it. A case always depends on the cases before it with the same name, they work in the same directory.
+    In incremental mode, a worker is skipped if its fingerprint matches the one recorded in the manifest of its case at its
+    last successful run, and no worker it depends on has been run, also when the workers are executed in order. upstream_ran tells that a worker before the factory has been run. """
+
+    # Workers currently executing, the innermost one last. Shared by all (nested) factories of the process.
+    running = []
+    _sig_abort = threading.Event()
+    incremental = False
+
+    def __init__(self, config, context = None, upstream_ran = False):
         self.conf_root = config.getroot()
         if context is None: # You should not use context={} as default value in function arguments
             context = ContextManager()
             
         self.context = context
+        self.upstream_ran = upstream_ran
 
     def workers(self):
         """ Yields all workers in order of the XML file, even if they are not activated. """
@@ -61,12 +81,167 @@ class WorkerFactory():
                 obj = cls(conf_etree, self.context)
                 yield obj
 
+    def dependencies(self, nodes):
+        """ Returns a set of indices into nodes for each node, the workers it depends on. Only preceding workers can be depended on,
+        so the dependencies can't form a cycle. """
+        names = [n.get("name", n.tag) for n in nodes]
+        deps = []
+        for i, node in enumerate(nodes):
+            if node.get("after") is not None:
+                after = set(a.strip() for a in node.get("after").split(",") if a.strip())
+                unknown = after.difference(names[:i])
+                if unknown.intersection(names[i + 1:]):
+                    raise WorkerError("Worker %s depends on %s, which comes after it. Only workers before it can be depended on." % (names[i], ", ".join(sorted(unknown))))
+                elif unknown:
+                    raise WorkerError("Worker %s depends on %s, which is not a worker before it." % (names[i], ", ".join(sorted(unknown))))
+                dep = set(j for j in range(i) if names[j] in after)
+            elif node.tag == "case":
+                sources = set(norm_path(c.get("source")) for c in node.findall("./create/mesh/copy") if c.get("source"))
+                dep = set(j for j in range(i) if nodes[j].tag == "case" and norm_path(names[j]) in sources)
+            else:
+                dep = set(range(i))
+            if node.tag == "case" and node.get("name"):
+                # E.g. a case creating the case directory and one solving it
+                dep.update(j for j in range(i) if nodes[j].tag == "case" and norm_path(names[j]) == norm_path(names[i]))
+            deps.append(dep)
+        return deps
 
     def execute(self):
-        """ Executes all workers. """
-        for w in self.workers():
-            if w.do():
-                w.run()
+        """ Executes all workers. Returns True if any worker has been run, False if all have been skipped. """
+        parallel = int(self.conf_root.get("parallel", 1))
+        if parallel > 1:
+            return self.execute_parallel(parallel)
+
+        deps = self.dependencies([n for n in self.conf_root if n.tag in WorkerRegistry.workers])
+        ran = set()
+        for index, w in enumerate(self.workers()):
+            if self._sig_abort.is_set():
+                logger.debug("Abort signal is set, worker execution loop stopped.")
+                break
+            if self._run(w, index, self.upstream_ran or bool(deps[index] & ran)):
+                ran.add(index)
+        return bool(ran)
+
+    def _run(self, w, index, upstream_ran):
+        """ Runs the worker w, the index-th of the factory, if it is activated and, in incremental mode, not up to date.
+        Returns True if it has been run. Containers have been run if any of their subworkers has been run. """
+        try:
+            return self._run_worker(w, index, upstream_ran)
+        finally:
+            w.close()
+
+    def _run_worker(self, w, index, upstream_ran):
+        if not w.do():
+            return False
+        w.upstream_ran = upstream_ran
+        key = "%i:%s" % (index, w.name)
+        fingerprint = None
+        if w.skippable and w.case:
+            fingerprint = w.fingerprint()
+            if self.incremental and not upstream_ran and Manifest(w.case).get(key) == fingerprint:
+                logger.info("Inputs of worker %s are unchanged, skipping it.", w.name)
+                return False
+
+        self.running.append(w)
+        try:
+            result = w.run()
+        finally:
+            self.running.remove(w)
+        if fingerprint:
+            Manifest(w.case).record(key, fingerprint)
+        return True if w.skippable else bool(result)
+
+    def _run_node(self, index, node, upstream_ran, finished):
+        """ Creates and runs the worker of node with a copy of the context. Puts (index, exc_info or None, ran) into finished. """
+        try:
+            ran = self._run(WorkerRegistry.workers[node.tag](ET.ElementTree(node), self.context.clone()), index, upstream_ran)
+        except Exception:
+            finished.put( (index, sys.exc_info(), True) )
+        else:
+            finished.put( (index, None, ran) )
+
+    def execute_parallel(self, threads):
+        """ Executes the workers in up to threads threads, each one as soon as the workers it depends on have finished.
+        If a worker fails or the execution is aborted, no further workers are started. The exception of the first failed
+        worker is raised when all running workers have finished. Returns True if any worker has been run. """
+        nodes = [n for n in self.conf_root if n.tag in WorkerRegistry.workers]
+        deps = self.dependencies(nodes)
+        finished = Queue.Queue()
+        pending = range(len(nodes))
+        done = set()
+        ran = set()
+        error = None
+        active = 0
+        while True:
+            if error is None and not self._sig_abort.is_set():
+                for i in [i for i in pending if deps[i] <= done][:threads - active]:
+                    pending.remove(i)
+                    active += 1
+                    upstream_ran = self.upstream_ran or bool(deps[i] & ran)
+                    thread = threading.Thread(target=self._run_node, args=(i, nodes[i], upstream_ran, finished))
+                    thread.daemon = True
+                    thread.start()
+            if active == 0:
+                break
+            i, exc_info, worker_ran = finished.get()
+            active -= 1
+            if worker_ran:
+                ran.add(i)
+            if exc_info is None:
+                done.add(i)
+            elif error is None:
+                logger.error("Worker %s failed, waiting for %i running workers.", nodes[i].get("name", nodes[i].tag), active)
+                error = exc_info
+
+        if error is not None:
+            raise error[0], error[1], error[2]
+        if pending and self._sig_abort.is_set():
+            logger.debug("Abort signal is set, %i workers not started.", len(pending))
+        return bool(ran)
+
+    @classmethod
+    def abort(cls):
+        """ Aborts the running workers and prevents all further workers from being executed. """
+        cls._sig_abort.set()
+        for w in reversed(cls.running):
+            w.abort()
+
+    @classmethod
+    def aborted(cls):
+        """ Returns True if the execution has been aborted. """
+        return cls._sig_abort.is_set()
+
+
+class Manifest():
+    """ The fingerprints of the workers of a case at their last successful run, stored as JSON in the case directory. """
+
+    _lock = threading.Lock() # Workers of a case may run in parallel
+
+    def __init__(self, case):
+        self.path = os.path.join(case, ".flof_manifest")
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def get(self, key):
+        """ Returns the fingerprint recorded for key, None if there is none. """
+        with self._lock:
+            return self._load().get(key)
+
+    def record(self, key, fingerprint):
+        """ Records the fingerprint for key. The manifest is replaced atomically. """
+        with self._lock:
+            manifest = self._load()
+            manifest[key] = fingerprint
+            if not os.path.isdir(os.path.dirname(self.path)):
+                return # The case has been removed
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(manifest, f, indent=1, sort_keys=True)
+            os.rename(self.path + ".tmp", self.path)
 
 
 class WorkerError(Exception):
@@ -81,28 +256,62 @@ class BaseWorker():
     """ Base Class for all workers. """
 
     _do_recursive_string_interpolation = True
+    skippable = True # False for containers, they are never skipped in incremental mode.
+    upstream_ran = False # Set by the WorkerFactory, True if a worker run before this one has been run.
+    _log_handler_file = None
         
     def __init__(self, configuration, context):
         # The directory to the case. The is no guarantee it actually exists, e.g. when it is created by the CaseBuilder.
         self.context = context
         self.config = configuration.getroot()
         self.do_string_interpolation(recurse=self._do_recursive_string_interpolation)
+        self.name = self.config.get("name", self.config.tag)
         if "name" in context:
             self.case = norm_path(context["name"])
         else:
             self.case = None
     
-        # Setup logging: Add an additional handler for worker based logfiles
+        # Setup logging: Add an additional handler for worker based logfiles, shared by all workers of the class logging to it
         self.logger = logging.getLogger(self.__class__.__module__ + "." + self.__class__.__name__ )
-        if self._logfilename():
-            handler = logging.FileHandler(self._logfilename())
-            handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s:%(levelname)s - %(message)s"))
-            self.logger.addHandler(handler)
+        self._log_handler_file = self._logfilename()
+        if self._log_handler_file:
+            common.acquire_log_handler(self.logger, self._log_handler_file)
             
+    def close(self):
+        """ Releases the handler of the worker based logfile. Called by the WorkerFactory when the worker has finished. """
+        if self._log_handler_file:
+            common.release_log_handler(self.logger, self._log_handler_file)
+            self._log_handler_file = None
         
     def do(self):
         """ Returns the do attribute. """
         return common.getboolean(self.config.get("do", "True"))
+
+    def input_files(self):
+        """ Returns the files and directories, besides its configuration and the context, the worker depends on. """
+        return []
+
+    def fingerprint(self):
+        """ Returns a hash of the inputs of the worker: its interpolated configuration node, the context
+        and the size and modification time of all its input files. """
+        h = hashlib.sha1(ET.tostring(self.config))
+        h.update(repr(sorted(self.context.items())))
+        for path in sorted(norm_path(p) for p in self.input_files() if p):
+            if os.path.isdir(path):
+                files = sorted(os.path.join(d, f) for d, dirs, names in os.walk(path) for f in names)
+            else:
+                files = [path]
+            for f in files:
+                try:
+                    st = os.stat(f)
+                    h.update("%s %i %r\n" % (f, st.st_size, st.st_mtime))
+                except OSError:
+                    h.update("%s missing\n" % f)
+        return h.hexdigest()
+
+    def run_subworkers(self):
+        """ Executes the subworkers of a container. Returns True if any of them has been run. """
+        return WorkerFactory(ET.ElementTree(self.config), self.context, self.upstream_ran).execute()
     
 
     def abort(self):
@@ -115,32 +324,26 @@ class BaseWorker():
             pass
         
 
+    def output_consumers(self):
+        """ Returns the callables that are called with each line of output of the processes started by start_process.
+        The output is split into lines only if there are any. """
+        return []
+
     def start_process(self, command, no_shlex=False, raise_excpt=True, print_output = True, **kwargs):
         """ Starts a new subprocess using cmd. Saves it to abort it later.
         no_shlex=True to avoid shlex.split, e.g. for executing through a shell.
-        raise_excpt if a WorkerError exception should be raised on a return code != 0 """
+        raise_excpt if a WorkerError exception should be raised on a return code != 0
+        The output is appended to the log file in chunks and, if print_output, echoed to stdout at a limited rate. """
         cmd = command if no_shlex else shlex.split(command)
 
-        # Use an additional logger without formatting for process output. 
-        proclog = logging.getLogger(self.config.tag)
-        proclog.propagate = False # Process output should not propagate to the main logger
-        proclog.setLevel(logging.INFO)
-        logfile = self._logfilename()
-
-        if logfile:
-            proclog.addHandler(logging.FileHandler(logfile))
-            
-        if print_output:
-            proclog.addHandler(logging.StreamHandler(sys.stdout))
-
-        self.popen = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0, **kwargs)
-        while True:
-            output = self.popen.stdout.readline().decode()
-            if output == "" and self.popen.poll() != None:
-                break
-            proclog.info(output.rstrip("\n"))
-                            
-        ret_code = self.popen.returncode
+        stream = processoutput.OutputStream(self._logfilename(), sys.stdout if print_output else None, self.output_consumers())
+        try:
+            self.popen = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs)
+            processoutput.pump(self.popen.stdout.fileno(), stream)
+            self.popen.stdout.close()
+        finally:
+            stream.close()
+        ret_code = self.popen.wait()
 
         self.logger.debug("%s returned with %i", command, ret_code)        
 
@@ -3,9 +3,9 @@ from os.path import join
 
 from PyFoam.RunDictionary.ParsedParameterFile import ParsedBoundaryDict
 
-import common
+import common, configuration, meshcache
 from foamapi.parameterfile import FieldFile
-from baseworker import BaseWorker
+from baseworker import BaseWorker, WorkerError
 from common import norm_path
 
 
@@ -20,7 +20,22 @@ _OF_units = {
 
 
 class CaseCreator(BaseWorker):
-    """ The CaseCreator worker creates a new case from a given template, a mesh and a description of boundary conditions. """
+    """ The CaseCreator worker creates a new case from a given template, a mesh and a description of boundary conditions.
+
+    With ``<mesh cache="hardlink">`` or ``<mesh cache="copy">`` the created mesh is stored in the mesh cache, general.mesh_cache,
+    and taken from there by cases with the same mesh: the same fluent mesh file, arguments and OpenFOAM version,
+    or the same polyMesh to copy from. ``hardlink`` shares the read-only files of the cache, ``copy`` gives writable copies. """
+
+    def input_files(self):
+        """ The template and the mesh. """
+        files = [self.config.get("template")]
+        if self.config.find("./mesh/fluent") is not None:
+            files.append(self.config.find("./mesh/fluent").get("mesh"))
+        elif self.config.find("./mesh/copy") is not None:
+            tag = self.config.find("./mesh/copy")
+            src_case = tag.get("source", self.config.get("template"))
+            files.append(join(src_case, tag.get("time", "constant"), "polyMesh"))
+        return files
 
     def _copy_rec(self, rel_dir, dir_node):
         """ Recursive copy according to the <files> entry. """
@@ -50,11 +65,31 @@ class CaseCreator(BaseWorker):
         shutil.copy(self.context["config_file"], self.case)
 
 
+    def mesh_cache(self):
+        """ Returns the mesh cache to use, None if it is disabled. """
+        mesh = self.config.find("./mesh")
+        mode = mesh.get("cache", "off") if mesh is not None else "off"
+        if mode == "off":
+            return None
+        elif mode not in ("hardlink", "copy"):
+            raise WorkerError("Unknown mesh cache mode %s, expecting off, hardlink or copy." % mode)
+        config = configuration.Configuration()
+        return meshcache.MeshCache(config.get("general", "mesh_cache"), config.getint("general", "mesh_cache_size") * 1024**2)
+
     def create_mesh(self):
-        """ Create the mesh either from a fluent file or by copying from another OF case. """
+        """ Create the mesh either from a fluent file or by copying from another OF case. Does nothing without a <mesh> node. """
+        if self.config.find("./mesh") is None:
+            return
+        cache = self.mesh_cache()
+        cache_mode = self.config.find("./mesh").get("cache")
+        target = join(self.case, "constant/polyMesh")
         if self.config.find("./mesh/fluent") is not None:
             tag = self.config.find("./mesh/fluent")
             mesh = norm_path(tag.attrib["mesh"])
+            if cache:
+                key = cache.key([mesh], "fluentMeshToFoam", tag.get("arguments", ""), os.environ.get("WM_PROJECT_VERSION", ""))
+                if cache.fetch(key, target, cache_mode):
+                    return
             cmd = "fluentMeshToFoam -case %s %s %s" % (self.case, tag.get("arguments", ""), mesh)
             self.logger.info("Creating mesh from fluent mesh file %s", mesh)
             self.start_process(cmd)
@@ -63,8 +98,16 @@ class CaseCreator(BaseWorker):
             src_case = norm_path(tag.get("source", self.config.attrib["template"]))
             time = tag.get("time", "constant")
             src_path = join(src_case, time, "polyMesh")
+            if cache:
+                key = cache.key([src_path], "copy")
+                if cache.fetch(key, target, cache_mode):
+                    return
             self.logger.info("Copy mesh from %s", src_path)
-            shutil.copytree(src_path, join(self.case, "constant/polyMesh"))
+            shutil.copytree(src_path, target)
+        else:
+            return
+        if cache:
+            cache.store(key, target)
 
 
     def create_BCs(self):
@@ -1,5 +1,7 @@
 import common
 from baseworker import BaseWorker
+from foamapi.residualstore import ResidualWriter
+from foamapi.solverlog import SolverProgress
 
 import os, re
 
@@ -55,8 +57,32 @@ class Solver(FoamRunner):
       <solve name="simpleFoam" parallel="True" />
 
     ``parallel`` defaults to ``True``.
+
+    The progress of the solver, like time step and residuals, is parsed from its output and part of info.
+    The history of all time steps is written to a foamapi.residualstore next to the log file, log/<tag>.residuals.
     """
 
+    progress = None
+    residuals = None
+
+    def output_consumers(self):
+        logfile = self._logfilename()
+        self.residuals = ResidualWriter(logfile + ".residuals") if logfile else None
+        self.progress = SolverProgress(on_step = self.residuals.append if self.residuals else None)
+        return [self.progress.feed]
+
+    def start_process(self, command, **kwargs):
+        try:
+            return FoamRunner.start_process(self, command, **kwargs)
+        finally:
+            if self.residuals:
+                self.residuals.close()
+
+    def info(self):
+        info = FoamRunner.info(self)
+        if self.progress:
+            info.update(self.progress.info())
+        return info
 
     def run(self):
         print self.start_process(self.cmd())
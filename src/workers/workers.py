@@ -1,10 +1,10 @@
-import ConfigParser, os, shutil
+import ConfigParser, logging, multiprocessing, os, shutil, signal, sys
 
 import xml.etree.ElementTree as ET
 
 
 import common
-from baseworker import BaseWorker, WorkerError, WorkerFactory
+from baseworker import BaseWorker, ContextManager, WorkerError, WorkerFactory
 from common import norm_path
 
 class RootWorker(BaseWorker):
@@ -19,6 +19,8 @@ class RootWorker(BaseWorker):
             mpi_command = "mpirun -n {numProc} {command} -parallel">
       </flof>     
     """
+
+    skippable = False
     
     def __init__(self, configuration, context):
         context.update(configuration.getroot().attrib)
@@ -29,8 +31,7 @@ class RootWorker(BaseWorker):
 
     def run(self):
         """ Runs its subworkers. """
-        wf = WorkerFactory(ET.ElementTree(self.config), self.context)
-        wf.execute()
+        return self.run_subworkers()
 
 
 class Case(BaseWorker):
@@ -44,6 +45,8 @@ class Case(BaseWorker):
       <case name="new_case">
       </case>
     """
+
+    skippable = False
     
     def __init__(self, configuration, context):
         self._do_recursive_string_interpolation = False
@@ -52,8 +55,7 @@ class Case(BaseWorker):
 
     def run(self):
         """ Runs its subworkers. """
-        wf = WorkerFactory(ET.ElementTree(self.config), self.context)
-        wf.execute()
+        return self.run_subworkers()
 
         
     
@@ -68,6 +70,9 @@ class Spider(BaseWorker):
     
     position = 100
 
+    def input_files(self):
+        return [self.config.get("configuration")]
+
     defaults = {"overwrite":False}
 
     @property
@@ -127,7 +132,49 @@ class ExternalCommand(BaseWorker):
         
     
                 
+def _init_variation_process():
+    """ Initializer of the pool processes of a parallel Variation. On SIGTERM the workers of the process are aborted. """
+    del WorkerFactory.running[:] # Inherited from the parent, aborting them is the parent's business
+    def terminate(signum, frame):
+        WorkerFactory.abort()
+        sys.exit(1)
+    signal.signal(signal.SIGTERM, terminate)
+
+
+def _run_variation(args):
+    """ Executes one iteration of a parallel Variation in a pool process. Returns a tuple (ran, None or the error message). """
+    node, data, overrides, wd, upstream_ran = args
+    os.chdir(wd)
+    context = ContextManager(data)
+    context.overrides = overrides
+    try:
+        return WorkerFactory(ET.ElementTree(ET.fromstring(node)), context, upstream_ran).execute(), None
+    except Exception as e:
+        logging.getLogger(__name__).exception("Variation iteration failed.")
+        return True, "%s: %s" % (e.__class__.__name__, e)
+
+
 class Variation(BaseWorker):
+    """ Runs its subworkers once for each value of a range, with the value set as variable in the context.
+
+    ::
+
+      <variation variable="U" range="[1, 2, 5]" parallel="3">
+      </variation>
+
+    variable
+        Name of the context variable.
+
+    range
+        Python expression that evaluates to the values.
+
+    parallel
+        Number of iterations that are run concurrently in a process pool, each one with its own copy of the context.
+        The iterations must not depend on each other. Defaults to 1, which runs them one after another in this process.
+    """
+
+    skippable = False
+
     def __init__(self, configuration, context):
         self._do_recursive_string_interpolation = False
         BaseWorker.__init__(self, configuration, context)
@@ -138,21 +185,60 @@ class Variation(BaseWorker):
         original_node = ET.tostring(self.config)
         var_name = self.config.attrib["variable"]
         var_range = eval(self.config.attrib["range"])
+        parallel = int(self.config.get("parallel", 1))
         self.logger.info("Starting variation loop, variable: %s, range: %s", var_name, var_range)
         wd = os.getcwd()
+        if parallel > 1:
+            return self.run_parallel(original_node, var_name, var_range, parallel, wd)
+        ran = False
         for var in var_range:
             ctx = self.context
             ctx.update( {var_name : var} )
             self.logger.info("Doing variation, variable: %s, value: %s", var_name, var)
             os.chdir(wd)
-            wf = WorkerFactory(ET.ElementTree(self.config), self.context)
-            wf.execute()
+            wf = WorkerFactory(ET.ElementTree(self.config), self.context, self.upstream_ran)
+            ran = wf.execute() or ran
             self.config = ET.fromstring(original_node)
+        return ran
+
+    def run_parallel(self, node, var_name, var_range, processes, wd):
+        """ Runs the iterations in a pool of processes. A process is used for one iteration only, so nothing leaks between them. """
+        var_range = list(var_range)
+        overrides = dict(self.context.overrides)
+        # The parallel attribute of the variation sets its number of processes. Within an iteration it would have the
+        # WorkerFactory run the subworkers as a graph of dependencies, so it is stripped and they run one after another.
+        root = ET.fromstring(node)
+        del root.attrib["parallel"]
+        node = ET.tostring(root)
+        tasks = []
+        for var in var_range:
+            data = self.context.copy()
+            data[var_name] = var
+            tasks.append( (node, data, overrides, wd, self.upstream_ran) )
+
+        self.logger.info("Running %i iterations in %i processes.", len(tasks), processes)
+        pool = multiprocessing.Pool(processes, _init_variation_process, maxtasksperchild = 1)
+        try:
+            result = pool.map_async(_run_variation, tasks, chunksize = 1)
+            while not result.ready():
+                if WorkerFactory.aborted():
+                    raise WorkerError("Variation aborted.")
+                result.wait(1)
+            results = result.get()
+            pool.close()
+        except:
+            pool.terminate() # Pool processes abort their workers on SIGTERM
+            raise
+        finally:
+            pool.join()
+        os.chdir(wd)
+
+        failed = [(var, error) for var, (ran, error) in zip(var_range, results) if error]
+        if failed:
+            raise WorkerError("Variation failed for %s = %s" % (var_name, ", ".join("%s (%s)" % i for i in failed)))
+        return any(ran for ran, error in results)
             
 
-
-
-
 class Report(BaseWorker):
     def run(self):
         os.mkdir(os.path.join(self.case, "report"))